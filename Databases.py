@@ -5,4 +5,14 @@ class Databases(Profile):
 
 	def __init__(self, file, profile, ranks):
 		self.file = file
+		self.taxid_index = None
 		Profile.__init__(self, profile, ranks)
+
+	def getTaxIDIndex(self):
+		# Built once and shared by all tools using this database profile (invalidated by mergeRepeatedTaxIDs)
+		if self.taxid_index is None: self.taxid_index = Profile.getTaxIDIndex(self)
+		return self.taxid_index
+
+	def mergeRepeatedTaxIDs(self):
+		self.taxid_index = None
+		return Profile.mergeRepeatedTaxIDs(self)
@@ -0,0 +1,99 @@
+#!/usr/bin/python3
+# The MIT License (MIT)
+# 
+# Copyright (c) 2016 - Vitor C. Piro - PiroV@rki.de - vitorpiro@gmail.com
+# Robert Koch-Institut, Germany
+# All rights reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+# 
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+# 
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+
+import argparse, sys
+
+from metametamerge.Ranks import get_ranks
+from metametamerge.check_files import check_tax_cache
+# from Ranks import get_ranks
+# from check_files import check_tax_cache
+
+def main():
+	version = '1.1'
+
+	parser = argparse.ArgumentParser(description='MetaMetaCohort by Vitor C. Piro (vitorpiro@gmail.com, http://github.com/pirovc) - taxa x samples matrix from MetaMetaMerge profiles')
+	parser.add_argument('-i', '--input-files', metavar='<input_files>', dest="input_files", nargs="*", help="Merged profiles (bioboxes, tsv or npz), one for each sample")
+	parser.add_argument('-l', '--input-list', metavar='<input_list>', dest="input_list", type=str, default="", help="File with one merged profile per line, optionally preceded by a sample identifier (tab-separated)")
+
+	parser.add_argument('-n', '--names-file', metavar='<names_file>', dest="names_file", type=str, required=True, help="names.dmp from the NCBI Taxonomy database")
+	parser.add_argument('-e', '--nodes-file', metavar='<nodes_file>', dest="nodes_file", type=str, required=True, help="nodes.dmp from the NCBI Taxonomy database")
+	parser.add_argument('-m', '--merged-file', metavar='<merged_file>', dest="merged_file", type=str, required=True, help="merged.dmp from the NCBI Taxonomy database")
+	parser.add_argument('-x', '--taxonomy-cache', metavar='<taxonomy_cache>', dest="taxonomy_cache", type=str, default="", help="Folder to store a pre-compiled version of the taxonomy (names, nodes, merged). Built on first use (new or empty folder) and re-built automatically when the .dmp files change")
+	parser.add_argument('-s', '--ranks', metavar='<ranks>', dest="ranks", default="all", type=str, help="Comma-separated list of ranks (superkingdom,phylum,class,order,family,genus,species,all). Default: all")
+
+	parser.add_argument('-o', '--output-file', metavar='<output_file>', dest="output_file", type=str, required=True, help="Output file (.npz, see README)")
+	parser.add_argument('-j', '--threads', metavar='<threads>', dest="threads", type=int, default=1, help="Number of processes to parse the merged profiles in parallel. Default: 1")
+	parser.add_argument('--verbose', action='store_true', dest="verbose", help="Verbose output log")
+	parser.add_argument('-v', '--version', action='version', version='%(prog)s ' + version)
+
+	args = parser.parse_args()
+	if not args.input_files and not args.input_list: parser.error("one of the arguments -i/--input-files -l/--input-list is required")
+	if args.taxonomy_cache and check_tax_cache(args.taxonomy_cache): parser.error(check_tax_cache(args.taxonomy_cache))
+
+	# Imported after the arguments are parsed (numpy)
+	from metametamerge.pipeline import load_taxonomy
+	from metametamerge.cohort import parse_input_list, build_cohort, write_cohort
+	# from pipeline import load_taxonomy
+	# from cohort import parse_input_list, build_cohort, write_cohort
+
+	inputs = [(input_file, input_file) for input_file in args.input_files or []]
+	if args.input_list: inputs.extend(parse_input_list(args.input_list))
+	if "-" in [input_file for _,input_file in inputs]:
+		print("stdin (-) is not supported")
+		return 1
+
+	try:
+		# Sort input based on all ranks
+		ranks, all_ranks = get_ranks(args.ranks)
+	except ValueError as e:
+		print(e)
+		return 1
+
+	print("- - - - - - - - - - - - - - - - - - - - -")
+	print("           MetaMetaCohort %s" % version)
+	print("- - - - - - - - - - - - - - - - - - - - -")
+	print("Samples: %d" % len(inputs))
+	print("Taxonomy: \n %s, %s, %s" % (args.names_file,args.nodes_file,args.merged_file))
+	if args.taxonomy_cache: print("Taxonomy cache: %s" % args.taxonomy_cache)
+	print("Ranks: %s" % ', '.join(ranks.ranks))
+	print("Output file: %s" % args.output_file)
+	print("Threads: %d" % args.threads)
+	print("Verbose: %s" % args.verbose)
+	print("- - - - - - - - - - - - - - - - - - - - -")
+
+	print()
+	names, tax = load_taxonomy(args.names_file, args.nodes_file, args.merged_file, all_ranks, args.taxonomy_cache, args.verbose)
+
+	print()
+	print("Reading merged profiles ...")
+	matrix = build_cohort([input_file for _,input_file in inputs], names, tax, ranks, args.threads, args.verbose)
+
+	write_cohort(args.output_file, matrix, [sample_id for sample_id,_ in inputs], ranks)
+	print()
+	print("Output: %s" % args.output_file)
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,53 @@
+import numpy as np
+import os, hashlib
+from collections import defaultdict
+
+from metametamerge.Taxonomy import pack_strings, unpack_strings
+#from Taxonomy import pack_strings, unpack_strings
+
+def normalize_name(name):
+	# Case and whitespace insensitive names
+	return " ".join(name.split()).lower()
+
+def name_key(name, rank):
+	return rank + "\t" + normalize_name(name)
+
+def key_hash(key):
+	return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little')
+
+class NameIndex:
+
+	tables = ['scientific','other']
+	arrays = ['hash','taxid','blob','offsets']
+	def __init__(self, arrays):
+		# For each table (scientific and other names): 64-bit hashes of the normalized (rank, name) keys (sorted), taxid of each key (0 -> ambiguous, more than one taxid) and the keys (blob/offsets) to tell hash collisions apart
+		# Stored as arrays (cache), decoded once into {key: taxid} for each table to look up
+		self.arrays = arrays
+		self.keys = {t: dict(zip(unpack_strings(arrays[t + '_blob'], arrays[t + '_offsets']), arrays[t + '_taxid'].tolist())) for t in self.tables}
+
+	@classmethod
+	def fromTables(cls, all_names_scientific, all_names_other):
+		# all_names_scientific, all_names_other -> {(name,rank): [taxids]} (parse_tax)
+		arrays = {}
+		for table, names_table in zip(cls.tables, (all_names_scientific, all_names_other)):
+			keys = defaultdict(set)
+			for (name,rank),taxids in names_table.items():
+				keys[name_key(name, rank)].update(taxids)
+			keys = list(keys.items())
+			hashes = np.array([key_hash(key) for key,_ in keys], dtype=np.uint64)
+			order = np.argsort(hashes, kind='stable')
+			arrays[table + '_hash'] = hashes[order]
+			arrays[table + '_taxid'] = np.array([next(iter(taxids)) if len(taxids)==1 else 0 for _,taxids in keys], dtype=np.int32)[order]
+			arrays[table + '_blob'], arrays[table + '_offsets'] = pack_strings([keys[i][0] for i in order])
+		return cls(arrays)
+
+	@classmethod
+	def load(cls, folder, mmap=True):
+		return cls({t + '_' + a: np.load(os.path.join(folder, "names_" + t + '_' + a + ".npy"), mmap_mode='r' if mmap else None) for t in cls.tables for a in cls.arrays})
+
+	def save(self, folder):
+		for key,val in self.arrays.items(): np.save(os.path.join(folder, "names_" + key + ".npy"), val)
+
+	def lookup(self, table, name, rank):
+		# Taxid of (name, rank) on the table (scientific or other): None -> not found, 0 -> ambiguous
+		return self.keys[table].get(name_key(name, rank))
@@ -9,10 +9,16 @@ class Profile:
 			for pr in profileRanks:
 				self.profilerank[pr.rankid] = pr
 		else:
-			# From parse_files
+			# From parse_files (Presence, RankID, TaxID, Abundance)
+			profile = np.asarray(profile).reshape(-1,4)
+			# Group entries by rankid (keeping their order) on typed columns, each rank gets a slice (view) of them
+			rank = profile[:,1].astype(np.uint8)
+			order = np.argsort(rank, kind='stable')
+			rank = rank[order]
+			data = {c:profile[:,i][order].astype(ProfileRank.dtypes[c], copy=False) for c,i in zip(ProfileRank.columns,[0,2,3])}
 			for rankid in ranks.getIDs():
-				#Extract only iterated rankid and other columns that are not the rank column (redundant)
-				self.profilerank[rankid] = ProfileRank(profile[np.ix_(profile[:,1]==rankid, [0,2,3])],rankid,sum(profile[:,1]==rankid))
+				start, end = np.searchsorted(rank, [rankid, rankid+1])
+				self.profilerank[rankid] = ProfileRank({c:v[start:end] for c,v in data.items()},rankid,end-start)
 
 	def __iter__(self):
 		for rankid,profilerank in list(self.profilerank.items()):
@@ -32,68 +38,120 @@ class Profile:
 		return Profile([],[],subset_pr)
 
 	def getCol(self,col):
-		vals = []
-		for profilerank in list(self.profilerank.values()): 
-			vals.extend(profilerank.getCol(col))
-		return vals
+		return np.concatenate([profilerank.getCol(col) for profilerank in list(self.profilerank.values())] + [np.zeros(0, dtype=ProfileRank.dtypes[col])])
 	
 	def sort(self,cols):
 		for profilerank in list(self.profilerank.values()):
 			profilerank.sort(cols)
 
+	def getTaxIDIndex(self):
+		# Sorted taxids and their abundances (first entry over all ranks, as getSubSet('TaxID',taxid)) to be used with lookupTaxIDs
+		taxids = self.getCol('TaxID')
+		first_idx = np.unique(taxids, return_index=True)[1]
+		return taxids[first_idx], self.getCol('Abundance')[first_idx]
+
+	@staticmethod
+	def lookupTaxIDs(index, taxids):
+		# Returns if each taxid was found on the index and its abundance (0 if not found)
+		index_taxids, index_abundances = index
+		if not index_taxids.shape[0]: return np.zeros(len(taxids), dtype=bool), np.zeros(len(taxids))
+		pos = np.minimum(np.searchsorted(index_taxids, taxids), index_taxids.shape[0]-1)
+		found = index_taxids[pos]==taxids
+		return found, np.where(found, index_abundances[pos], 0)
+
 	def mergeRepeatedTaxIDs(self):
 		merged_taxids = []
 		for profilerank in list(self.profilerank.values()):
-			profilerank.mergeRepeatedTaxIDs()
-			merged_taxids.extend(profilerank.getSubSet(profilerank.getCol('Presence')>1).getCol('TaxID'))
+			merged_taxids.extend(profilerank.mergeRepeatedTaxIDs())
 		return merged_taxids
 			
 class ProfileRank:
 	
 	columns = ['Presence','TaxID','Abundance']
-	def __init__(self,profileRank,rankid,original_len=None):
-		self.cols = {c:i for i,c in enumerate(ProfileRank.columns)}
+	dtypes = {'Presence':np.uint16, 'TaxID':np.uint32, 'Abundance':np.float64}
+	def __init__(self,profileRank,rankid,original_len=None,idx=None):
+		# profileRank -> {column: array} (shared, not copied) or 2D array with the columns Presence, TaxID, Abundance
+		# idx -> index view of the selected (filter, getSubSet) and sorted entries on the columns (None -> all entries, in order)
 		self.rankid = rankid
-		self.profilerank = profileRank
+		if isinstance(profileRank, dict):
+			self.data = profileRank
+		else:
+			profileRank = np.asarray(profileRank).reshape(-1,len(ProfileRank.columns))
+			self.data = {c:profileRank[:,i].astype(ProfileRank.dtypes[c]) for i,c in enumerate(ProfileRank.columns)}
+		self.idx = idx
 		if original_len: self.original_len = original_len
 
 	def __iter__(self):
-		for v in self.profilerank:
-			yield  {c:v[i] for i,c in enumerate(self.columns)}
+		for i in (range(self.getSize()) if self.idx is None else self.idx):
+			yield ProfileRow(self.data,i)
 			
 	def getSize(self):
-		return int(self.profilerank.shape[0])
+		return int(self.data['TaxID'].shape[0] if self.idx is None else self.idx.shape[0])
+	
+	def getIndex(self,idx):
+		# Position on the columns of the entries selected by idx (mask or index relative to the current entries)
+		if self.idx is None: return np.flatnonzero(idx) if np.asarray(idx).dtype==bool else np.asarray(idx)
+		return self.idx[idx]
 		
 	def getSubSet(self,idx):
-		return ProfileRank(self.profilerank[idx],self.rankid)
+		# View sharing the columns
+		return ProfileRank(self.data,self.rankid,idx=self.getIndex(idx))
 	
 	def filter(self,idx):
-		self.profilerank = self.profilerank[idx]
+		self.idx = self.getIndex(idx)
 	
 	def getCol(self,col):
-		return self.profilerank[:,self.cols[col]]
+		return self.data[col] if self.idx is None else self.data[col][self.idx]
+	
+	def setCol(self,col,values):
+		if self.idx is None: self.data[col][:] = values
+		else: self.data[col][self.idx] = values
 		
 	def getRow(self,start,end):
-		return ProfileRank(self.profilerank[start:end,:],self.rankid)
+		if self.idx is None: return ProfileRank({c:v[start:end] for c,v in self.data.items()},self.rankid)
+		return ProfileRank(self.data,self.rankid,idx=self.idx[start:end])
+	
+	def compact(self):
+		# Keep only the selected entries on the columns, in order
+		if self.idx is not None:
+			self.data = {c:self.getCol(c) for c in ProfileRank.columns}
+			self.idx = None
 				
 	def sort(self,cols):
-		ord = tuple(self.profilerank[:,self.cols[c]]*s for c,s in cols)
+		ord = tuple(self.getCol(c).astype(np.float64)*s for c,s in cols)
 		sort_idx = np.lexsort(ord)
-		self.profilerank = self.profilerank[sort_idx]
+		self.filter(sort_idx)
 	
 	def mergeRepeatedTaxIDs(self):
-		values, counts = np.unique(self.getCol('TaxID'), return_counts=True)
-		repeated_taxids = values[counts>1]
-		if repeated_taxids.any():
-			merged_entries = []
-			# Use field 'Presence' to account for repeated entries
-			for rt in repeated_taxids:
-				sub_rt = self.getSubSet(self.getCol('TaxID')==rt)
-				merged_entries.append([np.sum(sub_rt.getCol('Presence')),rt,np.sum(sub_rt.getCol('Abundance'))])
-			# Remove repeated
-			self.profilerank = self.profilerank[~np.in1d(self.getCol('TaxID'),repeated_taxids)]
-			# Add merged
-			self.profilerank = np.vstack([self.profilerank, merged_entries])
-		
-		
-		
\ No newline at end of file
+		# Collapse entries with the same taxid into one (added at the end, sorted by taxid), returning the repeated taxids
+		taxids = self.getCol('TaxID')
+		order = np.argsort(taxids, kind='stable')
+		sorted_taxids = taxids[order]
+		starts = np.flatnonzero(np.concatenate([[True], sorted_taxids[1:]!=sorted_taxids[:-1]])) if sorted_taxids.shape[0] else np.zeros(0, dtype=int)
+		counts = np.diff(np.append(starts, sorted_taxids.shape[0]))
+		repeated = counts>1
+		if not repeated.any(): return sorted_taxids[:0]
+		# Entries of repeated taxids grouped by taxid (keeping their order)
+		repeated_idx = order[np.repeat(repeated, counts)]
+		repeated_starts = np.concatenate([[0], np.cumsum(counts[repeated])[:-1]])
+		repeated_taxids = sorted_taxids[starts[repeated]]
+		# Use field 'Presence' to account for repeated entries
+		merged_entries = {'Presence': np.add.reduceat(self.getCol('Presence')[repeated_idx].astype(np.uint64), repeated_starts).astype(ProfileRank.dtypes['Presence']),
+						'TaxID': repeated_taxids,
+						'Abundance': np.add.reduceat(self.getCol('Abundance')[repeated_idx], repeated_starts)}
+		# Remove repeated and add merged
+		not_repeated = np.ones(taxids.shape[0], dtype=bool)
+		not_repeated[repeated_idx] = False
+		self.data = {c:np.concatenate([self.getCol(c)[not_repeated], merged_entries[c]]) for c in ProfileRank.columns}
+		self.idx = None
+		return repeated_taxids
+
+class ProfileRow:
+	# Row view on the columns of a ProfileRank (pr['TaxID'])
+	__slots__ = ['data','i']
+	def __init__(self,data,i):
+		self.data = data
+		self.i = i
+
+	def __getitem__(self,col):
+		return self.data[col][self.i]
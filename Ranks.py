@@ -11,3 +11,13 @@ class Ranks:
 		
 	def getRankName(self,rankid):
 		return self.ranks[rankid]
+
+ALL_RANKS = ['superkingdom','phylum','class','order','family','genus','species']
+
+def get_ranks(ranks="species"):
+	# Comma-separated list of ranks ("all" -> all ranks) sorted as all_ranks, returns (ranks, all_ranks)
+	all_ranks = Ranks(list(ALL_RANKS))
+	if not ranks or ranks=="all": return all_ranks, all_ranks
+	for r in ranks.split(","):
+		if r.strip() not in all_ranks.ranks: raise ValueError("Rank [%s] not supported - Avaiable ranks: %s" % (r.strip(), all_ranks.ranks))
+	return Ranks(sorted([r.strip() for r in ranks.split(",")], key=lambda x: all_ranks.ranks.index(x))), all_ranks
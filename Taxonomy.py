@@ -0,0 +1,108 @@
+import numpy as np
+import os
+
+def pack_strings(strings):
+	# List of strings -> concatenated utf-8 bytes + offsets (string i = blob[offsets[i]:offsets[i+1]])
+	encoded = [s.encode('utf-8') for s in strings]
+	offsets = np.zeros(len(encoded)+1, dtype=np.int64)
+	offsets[1:] = np.cumsum([len(e) for e in encoded])
+	return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+def unpack_strings(blob, offsets):
+	data = blob.tobytes()
+	offsets = offsets.tolist()
+	return [data[start:end].decode('utf-8') for start,end in zip(offsets[:-1], offsets[1:])]
+
+class Taxonomy:
+
+	arrays = ['parent','rank','rank_names','name_blob','name_offsets','merged','lineage','lineage_ranks']
+	def __init__(self, parent, rank, rank_names, name_blob, name_offsets, merged, lineage=None, lineage_ranks=None):
+		# Dense arrays indexed by taxid: parent (0 -> taxid not in nodes.dmp), rank code, name (interned in name_blob) and merged (0 -> not merged)
+		self.parent = parent
+		self.rank = rank
+		self.rank_names = [str(r) for r in rank_names]
+		self.name_blob = name_blob
+		self.name_offsets = name_offsets
+		self.merged = merged
+		# lineage[taxid,i] -> ancestor of taxid (itself included) at rank lineage_ranks[i], 0 if not in the lineage
+		self.lineage = lineage
+		self.lineage_ranks = [str(r) for r in lineage_ranks] if lineage_ranks is not None else []
+
+	@classmethod
+	def fromLists(cls, taxids, parents, ranks, names, merged):
+		# names -> {taxid: name}, merged -> {old_taxid: new_taxid}
+		max_taxid = max(taxids)
+		rank_names = sorted(set(ranks))
+		rank_codes = {r:code for code,r in enumerate(rank_names)}
+		parent = np.zeros(max_taxid+1, dtype=np.int32)
+		parent[taxids] = parents
+		rank = np.zeros(max_taxid+1, dtype=np.uint8)
+		rank[taxids] = [rank_codes[r] for r in ranks]
+		name_blob, name_offsets = pack_strings([names.get(taxid,'') for taxid in range(max_taxid+1)])
+		merged_array = np.zeros((max(merged)+1) if merged else 1, dtype=np.int32)
+		if merged: merged_array[list(merged.keys())] = list(merged.values())
+		return cls(parent, rank, np.array(rank_names), name_blob, name_offsets, merged_array)
+
+	@classmethod
+	def load(cls, folder, mmap=True):
+		# Memory-mapped arrays are shared (page cache) between concurrent processes
+		return cls(*[np.load(os.path.join(folder, a + ".npy"), mmap_mode='r' if mmap else None) for a in cls.arrays])
+
+	def buildLineage(self, ranks):
+		rankid_by_code = np.array([ranks.ranks.index(r) if r in ranks.ranks else -1 for r in self.rank_names], dtype=np.int64)
+		lineage = np.zeros((self.parent.shape[0], len(ranks.ranks)), dtype=np.int32)
+		# Walk all nodes up to the root at once, one level per iteration
+		taxids = np.flatnonzero(self.parent)
+		taxids = taxids[taxids!=1]
+		txid = taxids.copy()
+		while taxids.size:
+			rankid = rankid_by_code[self.rank[txid]]
+			valid = rankid>=0
+			# Higher ancestors overwrite lower ones with the same rank (as when walking the tree)
+			lineage[taxids[valid], rankid[valid]] = txid[valid]
+			txid = self.parent[txid]
+			not_root = (txid!=1) & (txid!=0)
+			taxids = taxids[not_root]
+			txid = txid[not_root]
+		self.lineage = lineage
+		self.lineage_ranks = list(ranks.ranks)
+
+	def save(self, folder):
+		for a in self.arrays: np.save(os.path.join(folder, a + ".npy"), np.asarray(getattr(self, a)))
+
+	def __contains__(self, taxid):
+		taxid = int(taxid)
+		return 0 < taxid < self.parent.shape[0] and self.parent[taxid]!=0
+
+	def getParent(self, taxid):
+		return int(self.parent[int(taxid)])
+
+	def getRank(self, taxid):
+		return self.rank_names[self.rank[int(taxid)]]
+
+	def getName(self, taxid):
+		taxid = int(taxid)
+		return self.name_blob[self.name_offsets[taxid]:self.name_offsets[taxid+1]].tobytes().decode('utf-8')
+
+	def getValidTaxIDs(self, taxids):
+		# Vectorized taxid look-up: valid taxids are kept, merged taxids are updated, 0 if not found
+		taxids = np.asarray(taxids, dtype=np.int64)
+		valid_taxids = np.zeros(taxids.shape, dtype=np.int64)
+		in_nodes = (taxids>0) & (taxids<self.parent.shape[0])
+		in_nodes[in_nodes] = self.parent[taxids[in_nodes]]!=0
+		valid_taxids[in_nodes] = taxids[in_nodes]
+		in_merged = ~in_nodes & (taxids>0) & (taxids<self.merged.shape[0])
+		valid_taxids[in_merged] = self.merged[taxids[in_merged]]
+		return valid_taxids
+
+	def getLineage(self, taxids):
+		# Ancestors of each taxid at each of the lineage_ranks (one row per taxid)
+		return self.lineage[np.asarray(taxids, dtype=np.int64)]
+
+	def getLineageRankID(self, rank):
+		return self.lineage_ranks.index(rank)
+
+	def getMerged(self, taxid):
+		# Updated taxid for an old (merged) taxid, 0 if not merged
+		taxid = int(taxid)
+		return int(self.merged[taxid]) if 0 < taxid < self.merged.shape[0] else 0
@@ -11,31 +11,36 @@ class Tools(Profile):
 		Profile.__init__(self, profile, ranks)
 
 	def checkDB(self, db, ranks, verbose):
-		db_taxids = db.getCol('TaxID')
-		taxids_not_found = []
+		# Sorted taxids of the database profile
+		db_index = db.getTaxIDIndex()
 		for profilerank in list(self.profilerank.values()): 
 			taxids = profilerank.getCol('TaxID')
-			taxids_in_db = np.in1d(taxids,db_taxids)
+			taxids_in_db, _ = Profile.lookupTaxIDs(db_index, taxids)
 			if verbose:
 				for t in taxids[~taxids_in_db]: print(("Ignored entry [%d] rank [%s] - taxon not found in the database profile" % (t,ranks.getRankName(profilerank.rankid))))
 			if taxids[~taxids_in_db].any(): print(("\t%d filtered taxons [%s] (not found on database profile)") % (len(taxids[~taxids_in_db]),ranks.getRankName(profilerank.rankid)))
 			# Filter them out
 			profilerank.filter(taxids_in_db)
 			
-	def estimateAbundance(self, db, verbose): 
+	def estimateAbundance(self, db, ranks, verbose): 
+		# Divide the abundances (sum of read lengths) by the length of each taxid on the database profile (unique after mergeRepeatedTaxIDs)
+		db_index = db.getTaxIDIndex()
 		for profilerank in list(self.profilerank.values()): 
-			for pr in profilerank:
-				taxid = pr['TaxID']
-				# Get db length for taxid (unique after mergeRepeatedTaxIDs)
-				db_len = db.getSubSet('TaxID',taxid).getCol('Abundance')[0]
-				new_ab = pr['Abundance']/float(db_len)
-				profilerank.profilerank[profilerank.getCol('TaxID')==taxid,profilerank.cols['Abundance']] = new_ab
+			taxids = profilerank.getCol('TaxID')
+			taxids_in_db, db_len = Profile.lookupTaxIDs(db_index, taxids)
+			valid_len = taxids_in_db & (db_len>0)
+			if verbose:
+				for t in taxids[~valid_len]: print(("Ignored entry [%d] rank [%s] - taxon without length on the database profile" % (t,ranks.getRankName(profilerank.rankid))))
+			if taxids[~valid_len].any(): print(("\t%d filtered taxons [%s] (missing or zero length on database profile)") % (len(taxids[~valid_len]),ranks.getRankName(profilerank.rankid)))
+			# Filter them out
+			profilerank.filter(valid_len)
+			profilerank.setCol('Abundance', profilerank.getCol('Abundance') / db_len[valid_len])
 			
 	def normalizeAbundance(self): 
 		for profilerank in list(self.profilerank.values()): 
 			totalAbundance = np.sum(profilerank.getCol('Abundance'))
 			# Normalize by the max (everything always between 0 and 1)
-			if totalAbundance: profilerank.profilerank[:,profilerank.cols['Abundance']] *= 1/float(totalAbundance)
+			if totalAbundance: profilerank.setCol('Abundance', profilerank.getCol('Abundance') * (1/float(totalAbundance)))
 			
 				
 	def filterMaxResults(self, max_results, ranks):
@@ -46,7 +51,7 @@ class Tools(Profile):
 				# Select max number number of results
 				mr = profilerank.getSize() if profilerank.getSize()<max_results else max_results
 				max_idx = np.array([True]*mr + [False]*(profilerank.getSize()-mr))
-				print(("\t%s - %d entries filtered [%s]") % (self.ident, profilerank.profilerank[~max_idx].shape[0], ranks.getRankName(profilerank.rankid)))
+				print(("\t%s - %d entries filtered [%s]") % (self.ident, np.sum(~max_idx), ranks.getRankName(profilerank.rankid)))
 				# Filter results
 				profilerank.filter(max_idx)
 	
@@ -54,6 +59,6 @@ class Tools(Profile):
 		for profilerank in list(self.profilerank.values()): 
 			if profilerank.getSize():
 				min_ra_idx = profilerank.getCol('Abundance')>=min_relative_abundance
-				print(("\t%s - %d entries filtered [%s]") % (self.ident, profilerank.profilerank[~min_ra_idx].shape[0], ranks.getRankName(profilerank.rankid)))
+				print(("\t%s - %d entries filtered [%s]") % (self.ident, np.sum(~min_ra_idx), ranks.getRankName(profilerank.rankid)))
 				# Filter results
 				profilerank.filter(min_ra_idx)
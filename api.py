@@ -0,0 +1,129 @@
+import io, copy
+import numpy as np
+from contextlib import redirect_stdout
+
+from metametamerge.Ranks import Ranks, ALL_RANKS, get_ranks
+from metametamerge.Tools import Tools
+from metametamerge.Databases import Databases
+from metametamerge.parse_files import parse_files, binning_to_profile
+from metametamerge.pipeline import load_taxonomy, prepare_database, prepare_tool, count_databases, filter_tools, merge_tools, guided_cutoff, estimate_missing_ranks, merge_sample
+from metametamerge.write_files import write_output, write_detailed
+from metametamerge.npz_files import profile_arrays
+#from Ranks import Ranks, ALL_RANKS, get_ranks
+#from Tools import Tools
+#from Databases import Databases
+#from parse_files import parse_files, binning_to_profile
+#from pipeline import load_taxonomy, prepare_database, prepare_tool, count_databases, filter_tools, merge_tools, guided_cutoff, estimate_missing_ranks, merge_sample
+#from write_files import write_output, write_detailed
+#from npz_files import profile_arrays
+
+# Library API: each step of MetaMetaMerge on objects in memory (no intermediate files or processes)
+#  profiles -> arrays of (Presence, RankID, TaxID, Abundance) rows (RankID of ranks, see from_profile/from_binning), Tools or Databases
+#  names, tax -> loaded taxonomy (taxonomy)
+#  ranks, all_ranks -> Ranks (get_ranks)
+# The log of each step is written to log (file-like object) or discarded. It is captured with redirect_stdout (process-wide, not thread-safe)
+#
+#  names, tax = taxonomy(names_file, nodes_file, merged_file)
+#  ranks, all_ranks = get_ranks("genus,species")
+#  D = [database(parse(db_file, 'db', names, tax, ranks), ranks) for db_file in db_files]
+#  T = [tool(from_profile(taxids, rank_names, abundances, tax, ranks), "tool1", 'p', D[0], ranks), ...]
+#  profile, T_filtered = merge(T, D, tax, ranks, all_ranks, bins=4, cutoff=0.0001, mode="linear")
+#  text = to_text(profile, "tsv", tax, all_ranks)
+#  detailed = to_detailed_text(profile, T_filtered, D, tax, all_ranks)
+
+__all__ = ['get_ranks', 'taxonomy', 'parse', 'from_profile', 'from_binning', 'database', 'tool', 'normalize', 'filter_profiles', 'merge_profiles', 'apply_cutoff', 'estimate_ranks', 'merge', 'write', 'to_text', 'to_detailed_text', 'to_arrays']
+
+def logged(log):
+	return redirect_stdout(log if log is not None else io.StringIO())
+
+def taxonomy(names_file, nodes_file, merged_file, taxonomy_cache="", verbose=False, log=None):
+	# Returns (names, tax) with the lineages of all ranks
+	with logged(log):
+		return load_taxonomy(names_file, nodes_file, merged_file, Ranks(list(ALL_RANKS)), taxonomy_cache, verbose)
+
+def parse(input_file, method, names, tax, ranks, verbose=False, log=None, memo=None):
+	# Parse an input file (p -> profiling, b -> binning) or a database profile (db), returns the profile array
+	# memo -> dict shared by the files of one merge (taxids and names resolved once, same names and tax), None -> only for this file
+	with logged(log):
+		return np.asarray(parse_files(input_file, method, names, tax, ranks, verbose, memo=memo)).reshape(-1,4)
+
+def from_profile(taxids, rank_names, abundances, tax, ranks):
+	# Profile array from profiling entries (taxids are updated to the taxonomy, entries not found or on other ranks are ignored)
+	rankids = np.array([ranks.getRankID(r) if r in ranks.ranks else -1 for r in rank_names], dtype=int).reshape(-1)
+	taxids = tax.getValidTaxIDs(np.asarray(taxids, dtype=np.int64))
+	valid = (rankids>=0) & (taxids>0)
+	return np.column_stack([np.ones(np.sum(valid)), rankids[valid], taxids[valid], np.asarray(abundances, dtype=np.float64)[valid]])
+
+def from_binning(taxids, lengths, tax, ranks):
+	# Profile array from binning entries (taxid and length of each sequence), lengths are summed up to each rank
+	taxids = tax.getValidTaxIDs(np.asarray(taxids, dtype=np.int64))
+	valid = taxids>0
+	leaf_taxids, leaf_idx = np.unique(taxids[valid], return_inverse=True)
+	return binning_to_profile(np.column_stack([leaf_taxids, np.bincount(leaf_idx, weights=np.asarray(lengths, dtype=np.float64)[valid], minlength=leaf_taxids.shape[0])]), tax, ranks)[0]
+
+def database(profile, ranks, file="", log=None):
+	# Databases from a profile array (Databases are used as they are)
+	with logged(log):
+		return prepare_database(profile if isinstance(profile, Databases) else Databases(file, profile, ranks))
+
+def tool(profile, ident, method, db, ranks, verbose=False, file="", log=None):
+	# Tools from a profile array, checked against its database profile (db), with estimated (binning) and normalized abundances
+	# Tools (not yet prepared) are used as they are (and modified)
+	with logged(log):
+		return prepare_tool(profile if isinstance(profile, Tools) else Tools(file, ident, method, profile, ranks, verbose), db, ranks, verbose)
+
+def normalize(profile):
+	# Normalize the abundances of a Tools (sum 1 on each rank), in place
+	profile.normalizeAbundance()
+	return profile
+
+def filter_profiles(T, cutoff, ranks, log=None):
+	# Filtered copies of the tools (T is not modified)
+	T = copy.deepcopy(T)
+	with logged(log):
+		filter_tools(T, cutoff, ranks)
+	return T
+
+def merge_profiles(T, D, ranks, bins=4, log=None):
+	# Merge (already filtered) tools, D -> database profile of each tool. Returns the merged profile (Presence -> bin) and the number of bins used
+	with logged(log):
+		return merge_tools(T, count_databases(D), ranks, bins)
+
+def apply_cutoff(profile_merged, bin_n, ranks, mode="linear", verbose=False, log=None):
+	# Guided cutoff (mode) on a merged profile, returns a new profile with normalized abundances
+	with logged(log):
+		return guided_cutoff(profile_merged, bin_n, mode, ranks, verbose)
+
+def estimate_ranks(profile, tax, ranks, all_ranks, verbose=False, log=None):
+	# Profile on all_ranks, estimating the ranks not merged from the lowest one, sorted by abundance
+	with logged(log):
+		if ranks.ranks!=all_ranks.ranks: profile = estimate_missing_ranks(profile, tax, ranks, all_ranks, verbose)
+	profile.sort([('Abundance',-1)])
+	return profile
+
+def merge(T, D, tax, ranks, all_ranks, bins=4, cutoff=0.0001, mode="linear", verbose=False, log=None):
+	# Filter, merge, guided cutoff and rank estimation (as MetaMetaMerge.py), returns the final merged profile (all_ranks) and the filtered tools
+	# T is not modified
+	T_filtered = copy.deepcopy(T)
+	with logged(log):
+		return merge_sample(T_filtered, count_databases(D), tax, ranks, all_ranks, bins, cutoff, mode, verbose), T_filtered
+
+def write(profile, output_file, output_type, tax, all_ranks, nodes_file=""):
+	# output_file -> path or file object (not for npz)
+	write_output(output_file, output_type, nodes_file, profile, tax, all_ranks)
+
+def to_text(profile, output_type, tax, all_ranks, nodes_file=""):
+	# Merged profile as text (tsv or bioboxes)
+	out = io.StringIO()
+	write_output(out, output_type, nodes_file, profile, tax, all_ranks)
+	return out.getvalue()
+
+def to_detailed_text(profile, T, D, tax, all_ranks):
+	# Detailed output (as --detailed): T -> filtered tools (from merge or filter_profiles), not the tools before the cutoff
+	out = io.StringIO()
+	write_detailed(out, profile, T, D, tax, all_ranks)
+	return out.getvalue()
+
+def to_arrays(profile, all_ranks):
+	# Merged profile as columns {ranks, rank, taxid, abundance, presence} (same as the npz output)
+	return profile_arrays(profile, all_ranks)
@@ -0,0 +1,64 @@
+import io, os, sys, multiprocessing
+from contextlib import redirect_stdout
+
+from metametamerge.parse_files import parse_files_parallel
+from metametamerge.pipeline import count_databases, load_tools, merge_sample
+from metametamerge.write_files import write_output, write_detailed, write_parsed_profiles, detailed_output_file
+#from parse_files import parse_files_parallel
+#from pipeline import count_databases, load_tools, merge_sample
+#from write_files import write_output, write_detailed, write_parsed_profiles, detailed_output_file
+
+def sample_output_file(output_folder, sample_id, output_type):
+	return os.path.join(output_folder, sample_id + (".npz" if output_type=="npz" else ".out"))
+
+def run_sample(sample, D, identifiers, names, tax, ranks, all_ranks, args):
+	# Merge one sample re-using the already parsed taxonomy and database profiles (D, on the same order of identifiers)
+	sample_id, input_files, sample_identifiers, sample_methods = sample
+	sample_D = [D[identifiers.index(i)] for i in sample_identifiers]
+	output_file = sample_output_file(args.output_file, sample_id, args.output_type)
+
+	print("- - - - - - - - - - - - - - - - - - - - -")
+	print("Sample: %s" % sample_id)
+	for i,file in enumerate(input_files):
+		print((" %s (%s) %s") % (sample_identifiers[i],sample_methods[i],file))
+	print()
+	# Taxids and names resolved once for all the files of this sample
+	memo = {}
+	parsed_profiles = parse_files_parallel(list(zip(input_files,sample_methods)), names, tax, ranks, args.verbose, 1, memo=memo)
+	T = load_tools(input_files, sample_identifiers, sample_methods, parsed_profiles, sample_D, ranks, args.verbose)
+
+	if args.output_parsed_profiles:
+		write_parsed_profiles(os.path.join(args.output_file, sample_id + "."), args.nodes_file, T, tax, ranks, all_ranks, output_file.endswith(".gz"), args.output_type)
+
+	profile_merged_mode = merge_sample(T, count_databases(sample_D), tax, ranks, all_ranks, args.bins, args.cutoff, args.mode, args.verbose)
+
+	write_output(output_file, args.output_type, args.nodes_file, profile_merged_mode, tax, all_ranks)
+	if args.detailed:
+		write_detailed(detailed_output_file(output_file), profile_merged_mode, T, sample_D, tax, all_ranks, args.output_type)
+	print()
+	print("Output: %s" % output_file)
+
+# Arguments shared with the pool processes (inherited on fork, not pickled)
+batch_args = None
+
+def run_sample_job(sample):
+	# Run one sample capturing its log
+	log = io.StringIO()
+	with redirect_stdout(log):
+		run_sample(sample, *batch_args)
+	return log.getvalue()
+
+def run_batch(samples, D, identifiers, names, tax, ranks, all_ranks, args):
+	# Run all samples (in parallel with args.threads>1), printing their logs in order
+	if not os.path.isdir(args.output_file): os.makedirs(args.output_file)
+	if args.threads<=1 or len(samples)<=1:
+		for sample in samples:
+			run_sample(sample, D, identifiers, names, tax, ranks, all_ranks, args)
+		return
+
+	global batch_args
+	batch_args = (D, identifiers, names, tax, ranks, all_ranks, args)
+	with multiprocessing.get_context('fork').Pool(args.threads) as pool:
+		for log in pool.imap(run_sample_job, samples):
+			sys.stdout.write(log)
+	batch_args = None
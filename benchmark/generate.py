@@ -0,0 +1,217 @@
+import numpy as np
+import argparse, json, os
+
+# Synthetic NCBI-like taxonomy (nodes.dmp, names.dmp, merged.dmp) and matching database profiles, profiling and binning outputs
+# All values come from numpy.random.RandomState(seed), so the same parameters and seed always generate the same files
+
+RANKS = ['superkingdom','phylum','class','order','family','genus','species']
+# Ranks of the intermediate nodes (not merged by MetaMetaMerge)
+OTHER_RANKS = ['no rank','clade','subfamily','subgenus','suborder']
+
+PRESETS = {
+	# species: number of species, depth: max. number of intermediate nodes between two ranks, strains: fraction of species with strains
+	# synonyms: fraction of nodes with an additional name, merged: number of merged taxids
+	# genomes: reference genomes on each database profile, community: species in the sample, reads: reads on each binning output
+	# tools: methods of the tools (b -> binning, p -> profiling), names: fraction of profiling entries without taxid (only name)
+	'small': {'species': 2000, 'depth': 2, 'strains': 0.2, 'synonyms': 0.3, 'merged': 200, 'genomes': 1000, 'community': 200, 'reads': 100000, 'tools': 'b,p,p', 'names': 0.02},
+	'medium': {'species': 50000, 'depth': 4, 'strains': 0.3, 'synonyms': 0.3, 'merged': 5000, 'genomes': 20000, 'community': 1000, 'reads': 2000000, 'tools': 'b,b,p,p', 'names': 0.02},
+	'large': {'species': 500000, 'depth': 8, 'strains': 0.5, 'synonyms': 0.5, 'merged': 80000, 'genomes': 200000, 'community': 3000, 'reads': 20000000, 'tools': 'b,b,p,p,p', 'names': 0.02},
+}
+
+# Lines written at once
+WRITE_LINES = 1000000
+
+def write_lines(output_file, lines):
+	with open(output_file, 'w') as out:
+		for i in range(0, len(lines), WRITE_LINES):
+			out.write("".join(lines[i:i+WRITE_LINES]))
+
+def generate_taxonomy(rng, species, depth, strains, synonyms, merged):
+	# Returns taxids, parent, rank names and scientific names (by node), merged (old taxid -> new taxid) and names.dmp lines
+	# Number of nodes on each rank grows geometrically from 3 superkingdoms to the number of species
+	n_rank = [max(int(round(3*(species/3.)**(i/6.))), 1) for i in range(len(RANKS))]
+	n_rank[-1] = species
+	# Nodes are created in tree order (index), root -> 0
+	parent = [np.zeros(1, dtype=np.int64)]
+	rank = [np.array(['no rank'], dtype=object)]
+	level = np.zeros(1, dtype=np.int64)
+	n = 1
+	for r, count in zip(RANKS, n_rank):
+		parent.append(level[rng.randint(0, level.shape[0], count)])
+		rank.append(np.full(count, r, dtype=object))
+		level = np.arange(n, n+count)
+		n += count
+	# Strains below species
+	has_strains = level[rng.rand(level.shape[0])<strains]
+	n_strains = rng.randint(1, 4, has_strains.shape[0])
+	parent.append(np.repeat(has_strains, n_strains))
+	rank.append(np.full(int(n_strains.sum()), 'strain', dtype=object))
+	parent = np.concatenate(parent)
+	rank = np.concatenate(rank)
+
+	# Intermediate nodes: each pass inserts a node above ~30% of the nodes (deeper lineages with more passes)
+	for _ in range(depth):
+		selected = np.flatnonzero(rng.rand(parent.shape[0])<0.3)
+		selected = selected[selected>0]
+		new = np.arange(parent.shape[0], parent.shape[0]+selected.shape[0])
+		parent = np.concatenate([parent, parent[selected]])
+		rank = np.concatenate([rank, np.array(OTHER_RANKS, dtype=object)[rng.randint(0, len(OTHER_RANKS), selected.shape[0])]])
+		parent[selected] = new
+
+	# Sparse and shuffled taxids (root -> 1), the remaining ones are used as merged (old) taxids
+	n_nodes = parent.shape[0]
+	pool = rng.permutation(np.arange(2, int(n_nodes*1.3)+merged+2))
+	taxids = np.concatenate([[1], pool[:n_nodes-1]])
+	parent_taxids = taxids[parent]
+	# Merged taxids point mostly to species
+	species_idx = np.flatnonzero(rank=='species')
+	targets = np.where(rng.rand(merged)<0.8, species_idx[rng.randint(0, species_idx.shape[0], merged)], rng.randint(1, n_nodes, merged))
+	merged_taxids = dict(zip(pool[n_nodes-1:n_nodes-1+merged].tolist(), taxids[targets].tolist()))
+
+	# Scientific names are unique, synonyms are drawn from a smaller pool (some of them are ambiguous)
+	sci_names = np.array(["%s %d" % (r.capitalize(), t) for r,t in zip(rank.tolist(), taxids.tolist())], dtype=object)
+	names_lines = ["%d\t|\t%s\t|\t\t|\tscientific name\t|\n" % (t, name) for t,name in zip(taxids.tolist(), sci_names.tolist())]
+	with_synonym = np.flatnonzero(rng.rand(n_nodes)<synonyms)
+	synonym_ids = rng.randint(0, max(int(with_synonym.shape[0]*0.9),1), with_synonym.shape[0])
+	names_lines += ["%d\t|\tSynonym %d\t|\t\t|\tsynonym\t|\n" % (t, s) for t,s in zip(taxids[with_synonym].tolist(), synonym_ids.tolist())]
+	# names.dmp is sorted by taxid
+	order = np.argsort(np.concatenate([taxids, taxids[with_synonym]]), kind='stable')
+	names_lines = [names_lines[i] for i in order]
+
+	return taxids, parent_taxids, rank, sci_names, merged_taxids, names_lines
+
+def lineage_by_rank(parent, rank):
+	# Index of the ancestor (itself included) of each node on each of the RANKS, -1 if not in the lineage
+	lineage = np.full((parent.shape[0], len(RANKS)), -1, dtype=np.int64)
+	rankid = np.array([RANKS.index(r) if r in RANKS else -1 for r in rank.tolist()])
+	nodes = np.arange(1, parent.shape[0])
+	anc = nodes.copy()
+	while nodes.size:
+		valid = rankid[anc]>=0
+		lineage[nodes[valid], rankid[anc[valid]]] = anc[valid]
+		anc = parent[anc]
+		not_root = anc!=0
+		nodes, anc = nodes[not_root], anc[not_root]
+	return lineage
+
+def rank_sums(lineage, leaf_idx, values):
+	# Sum of values of the leafs by ancestor on each rank -> [(rank, ancestor indices, sums)]
+	sums = []
+	for rankid, r in enumerate(RANKS):
+		anc = lineage[leaf_idx, rankid]
+		valid = anc>=0
+		idx, inv = np.unique(anc[valid], return_inverse=True)
+		sums.append((r, idx, np.bincount(inv, weights=values[valid])))
+	return sums
+
+def generate_dataset(output_folder, params, seed):
+	rng = np.random.RandomState(seed)
+	if not os.path.isdir(output_folder): os.makedirs(output_folder)
+
+	taxids, parent_taxids, rank, sci_names, merged, names_lines = generate_taxonomy(rng, params['species'], params['depth'], params['strains'], params['synonyms'], params['merged'])
+	# Node index by taxid (all arrays are indexed by node)
+	node_of = np.full(taxids.max()+1, -1, dtype=np.int64)
+	node_of[taxids] = np.arange(taxids.shape[0])
+	parent = node_of[parent_taxids]
+	parent[0] = 0
+	lineage = lineage_by_rank(parent, rank)
+	# Old taxids of each node (merged.dmp)
+	old_taxids = {}
+	for old, new in merged.items(): old_taxids.setdefault(int(node_of[new]), []).append(old)
+
+	write_lines(os.path.join(output_folder, "nodes.dmp"), ["%d\t|\t%d\t|\t%s\t|\tXX\t|\t0\t|\n" % (t,p,r) for t,p,r in zip(taxids.tolist(), parent_taxids.tolist(), rank.tolist())])
+	write_lines(os.path.join(output_folder, "names.dmp"), names_lines)
+	write_lines(os.path.join(output_folder, "merged.dmp"), ["%d\t|\t%d\t|\n" % (old,new) for old,new in sorted(merged.items())])
+	del names_lines
+
+	def entry_taxid(idx, names_fraction, merged_fraction):
+		# (taxid, name) of profile entries: sometimes replaced by their name (taxid 0) or by an old (merged) taxid
+		x = rng.rand(idx.shape[0])
+		out = []
+		for i, xi in zip(idx.tolist(), x.tolist()):
+			if xi<names_fraction: out.append((0, sci_names[i]))
+			elif xi<names_fraction+merged_fraction and i in old_taxids: out.append((old_taxids[i][0], ""))
+			else: out.append((int(taxids[i]), ""))
+		return out
+
+	# Leafs: species and strains
+	leafs = np.flatnonzero((rank=='species') | (rank=='strain'))
+	community = None
+	tools = []
+	for toolid, method in enumerate(params['tools'].split(",")):
+		ident = "tool%d" % (toolid+1)
+		# Database profile: reference genomes (leafs) with their lengths, summed on each rank
+		genomes = leafs[rng.choice(leafs.shape[0], min(params['genomes'], leafs.shape[0]), replace=False)]
+		genome_len = np.round(rng.lognormal(15, 0.5, genomes.shape[0]))
+		db_file = ident + ".db.tsv"
+		db_lines = []
+		for r, idx, sums in rank_sums(lineage, genomes, genome_len):
+			db_lines += ["%s\t%d\t%d\n" % (r, t, s) for (t, _), s in zip(entry_taxid(idx, 0, 0.01), sums.tolist())]
+		write_lines(os.path.join(output_folder, db_file), db_lines)
+
+		# Community (species of the first database, shared among all tools) and abundances
+		if community is None:
+			community_species = np.unique(lineage[genomes, RANKS.index('species')])
+			community = community_species[rng.choice(community_species.shape[0], min(params['community'], community_species.shape[0]), replace=False)]
+			abundance = rng.lognormal(0, 1.5, community.shape[0])
+			abundance /= abundance.sum()
+
+		if method=='b':
+			input_file = ident + ".binning.tsv"
+			# Reads of each species (by abundance), assigned to the species (85%), genus (9%), another leaf (1%) or not found (5%)
+			read_species = community[rng.choice(community.shape[0], params['reads'], p=abundance)]
+			x = rng.rand(params['reads'])
+			read_node = np.where(x<0.85, read_species, np.where(x<0.94, lineage[read_species, RANKS.index('genus')], leafs[rng.randint(0, leafs.shape[0], params['reads'])]))
+			read_taxid = np.where(x<0.95, taxids[read_node], 0)
+			read_len = rng.randint(100, 251, params['reads'])
+			with open(os.path.join(output_folder, input_file), 'w') as out:
+				out.write("@Version:0.9.1\n@SampleID:%s\n\n@@SEQUENCEID\tTAXID\tLENGTH\n" % ident)
+				for start in range(0, params['reads'], WRITE_LINES):
+					end = min(start+WRITE_LINES, params['reads'])
+					out.write("".join(["read%d\t%d\t%d\n" % (i, t, l) for i, t, l in zip(range(start, end), read_taxid[start:end].tolist(), read_len[start:end].tolist())]))
+		else:
+			# Profile: detected species (80%) + false positives (10% of the community), abundances with noise, summed on each rank
+			bioboxes = toolid%2==0
+			input_file = ident + (".profile.out" if bioboxes else ".profile.tsv")
+			detected = rng.rand(community.shape[0])<0.8
+			false_pos = leafs[rng.randint(0, leafs.shape[0], max(community.shape[0]//10, 1))]
+			false_pos = lineage[false_pos, RANKS.index('species')]
+			false_pos = false_pos[false_pos>=0]
+			species = np.concatenate([community[detected], false_pos])
+			ab = np.concatenate([abundance[detected]*rng.lognormal(0, 0.3, int(detected.sum())), rng.rand(false_pos.shape[0])*abundance.min()])
+			ab = 100*ab/ab.sum()
+			lines = ["# Taxonomic Profiling Output\n", "@SampleID:%s\n" % ident, "@Version:0.9.1\n", "@Ranks:%s\n" % "|".join(RANKS), "\n", "@@TAXID\tRANK\tTAXPATH\tTAXPATHSN\tPERCENTAGE\n"] if bioboxes else []
+			for rankid, (r, idx, sums) in enumerate(rank_sums(lineage, species, ab)):
+				for i, (t, n), s in zip(idx.tolist(), entry_taxid(idx, params['names'], params['names']), sums.tolist()):
+					if bioboxes:
+						path = [a for a in lineage[i, :rankid+1].tolist() if a>=0]
+						lines.append("%s\t%s\t%s\t%s\t%.6f\n" % (t if t else "", r, "|".join([str(taxids[a]) for a in path]), "|".join([sci_names[a] for a in path]), s))
+					else:
+						lines.append("%s\t%s\t%.6f\n" % (r, t if t else n, s))
+			write_lines(os.path.join(output_folder, input_file), lines)
+		tools.append({'ident': ident, 'method': method, 'input_file': input_file, 'database_profile': db_file})
+
+	dataset = {'params': params, 'seed': seed, 'nodes': int(taxids.shape[0]), 'names_file': "names.dmp", 'nodes_file': "nodes.dmp", 'merged_file': "merged.dmp", 'tools': tools}
+	with open(os.path.join(output_folder, "dataset.json"), 'w') as f:
+		json.dump(dataset, f, indent=1, sort_keys=True)
+	return dataset
+
+def main():
+	parser = argparse.ArgumentParser(description='MetaMetaMerge benchmark - synthetic taxonomy and profiles generator')
+	parser.add_argument('-o', '--output-folder', metavar='<output_folder>', dest="output_folder", type=str, required=True, help="Output folder (dataset.json + .dmp files + database profiles + tool outputs)")
+	parser.add_argument('-p', '--preset', metavar='<preset>', dest="preset", type=str, default="small", help="Preset of parameters (%s). Default: small" % ", ".join(PRESETS))
+	parser.add_argument('-s', '--seed', metavar='<seed>', dest="seed", type=int, default=0, help="Random seed. Default: 0")
+	for param, value in PRESETS['small'].items():
+		parser.add_argument('--' + param, metavar='<' + param + '>', dest=param, type=type(value), default=None, help="Overwrite the preset value")
+	args = parser.parse_args()
+	if args.preset not in PRESETS: parser.error("preset [%s] not available - %s" % (args.preset, ", ".join(PRESETS)))
+
+	params = dict(PRESETS[args.preset])
+	for param in params:
+		if getattr(args, param) is not None: params[param] = getattr(args, param)
+	params['preset'] = args.preset
+	dataset = generate_dataset(args.output_folder, params, args.seed)
+	print("%s: %d nodes, %d tools (%s)" % (args.output_folder, dataset['nodes'], len(dataset['tools']), params['tools']))
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,193 @@
+import numpy as np
+import argparse, copy, hashlib, io, json, os, platform, sys, tempfile, time
+from contextlib import redirect_stdout
+
+from metametamerge.Ranks import Ranks
+from metametamerge.Tools import Tools
+from metametamerge.parse_files import parse_files
+from metametamerge.pipeline import load_taxonomy, load_databases, count_databases, load_tools, filter_tools, merge_tools, apply_mode
+from metametamerge.write_files import write_output, write_detailed
+from metametamerge.npz_files import load_npz
+
+# Timed stages of MetaMetaMerge on a generated dataset (benchmark.generate), reported as JSON
+# Each stage result is digested (sha256) and checked against golden.json, so faster code can't silently change results
+
+GOLDEN_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden.json")
+
+def digest(*items):
+	# sha256 of arrays (dtype, shape and data) and strings
+	h = hashlib.sha256()
+	for item in items:
+		if isinstance(item, str):
+			h.update(item.encode('utf-8'))
+		else:
+			a = np.ascontiguousarray(item)
+			h.update(str((a.dtype.str, a.shape)).encode('utf-8'))
+			h.update(a.tobytes())
+	return h.hexdigest()
+
+def profile_digest(profile):
+	# Entries of a Profile on each rank, in order
+	return digest(*[item for rankid, profilerank in profile for item in [str(rankid)] + [profilerank.getCol(c) for c in ['Presence','TaxID','Abundance']]])
+
+def file_digest(output_file):
+	# Text output without the lines with file names
+	with open(output_file) as f:
+		return digest("".join([line for line in f if not line.startswith("@SampleID") and not line.startswith("@TaxonomyID")]))
+
+def timed(repeat, func, setup=None):
+	# Run func(*setup()) repeat times (setup and logs not timed), returns the result of the last run and the times in seconds
+	times = []
+	for _ in range(repeat):
+		with redirect_stdout(io.StringIO()):
+			args = setup() if setup else ()
+			start = time.perf_counter()
+			result = func(*args)
+			times.append(time.perf_counter()-start)
+	return result, times
+
+def run_benchmark(dataset_folder, repeat, bins, cutoff, mode):
+	with open(os.path.join(dataset_folder, "dataset.json")) as f: dataset = json.load(f)
+	path = lambda file: os.path.join(dataset_folder, file)
+	all_ranks = Ranks(['superkingdom','phylum','class','order','family','genus','species'])
+	ranks = all_ranks
+	tools = dataset['tools']
+	input_files = [path(t['input_file']) for t in tools]
+	database_files = [path(t['database_profile']) for t in tools]
+	identifiers = [t['ident'] for t in tools]
+	methods = [t['method'] for t in tools]
+	taxonomy_files = (path(dataset['names_file']), path(dataset['nodes_file']), path(dataset['merged_file']))
+
+	stages = {}
+	digests = {}
+	def stage(name, func, setup=None, result_digest=None):
+		result, times = timed(repeat, func, setup)
+		stages[name] = {'times': times, 'min': min(times), 'median': float(np.median(times))}
+		if result_digest: digests[name] = result_digest(result)
+		print("%-20s %10.4f s (min) %10.4f s (median)" % (name, stages[name]['min'], stages[name]['median']))
+		return result
+
+	def taxonomy_digest(taxonomy):
+		# Lineages and names of all taxids referenced by the dataset (same for the full and the lazy taxonomy)
+		names, tax = taxonomy
+		taxids = tax.getValidTaxIDs(referenced)
+		lineage = tax.getLineage(taxids)
+		return digest(taxids, lineage, "|".join([tax.getName(t) + ":" + tax.getRank(t) for t in np.unique(lineage).tolist() if t]))
+
+	jobs = list(zip(database_files, ['db']*len(tools))) + list(zip(input_files, methods))
+	# Taxids on the database profiles (reference for the taxonomy digests)
+	referenced = np.unique(np.concatenate([np.loadtxt(file, dtype=np.int64, usecols=[1], delimiter="\t", ndmin=1) for file in database_files]))
+	names, tax = stage('parse_tax', lambda: load_taxonomy(*taxonomy_files, all_ranks), result_digest=taxonomy_digest)
+	stage('parse_tax_lazy', lambda: load_taxonomy(*taxonomy_files, all_ranks, lazy_jobs=jobs), result_digest=taxonomy_digest)
+
+	# Parsed files of each method
+	parsed = {}
+	for method in ['db','p','b']:
+		files = [file for file, m in jobs if m==method]
+		if not files: continue
+		def parse_method():
+			return [parse_files(file, method, names, tax, ranks, False) for file in files]
+		parsed.update(zip([(file, method) for file in files], stage('parse_files_' + method, parse_method, result_digest=lambda r: digest(*r))))
+
+	D = stage('load_databases', lambda: load_databases(database_files, iter([parsed[(file,'db')] for file in database_files]), ranks), result_digest=lambda D: digest(*[profile_digest(db) for db in D]))
+	T = stage('load_tools', lambda: load_tools(input_files, identifiers, methods, iter([parsed[(file,method)] for file, method in zip(input_files, methods)]), D, ranks, False), result_digest=lambda T: digest(*[profile_digest(tool) for tool in T]))
+
+	def binning_tools():
+		# Binning tools up to the abundance estimation (as in load_tools)
+		B = []
+		for toolid in range(len(tools)):
+			if methods[toolid]!='b': continue
+			tool = Tools(input_files[toolid], identifiers[toolid], methods[toolid], parsed[(input_files[toolid], methods[toolid])], ranks, False)
+			tool.checkDB(D[toolid], ranks, False)
+			tool.mergeRepeatedTaxIDs()
+			B.append((tool, D[toolid]))
+		return (B,)
+	def estimate(B):
+		for tool, db in B: tool.estimateAbundance(db, ranks, False)
+		return [tool for tool, _ in B]
+	if 'b' in methods: stage('estimate_abundance', estimate, setup=binning_tools, result_digest=lambda B: digest(*[profile_digest(tool) for tool in B]))
+
+	dbs_count = count_databases(D)
+	def merge(T_cutoff):
+		filter_tools(T_cutoff, cutoff, ranks)
+		return (T_cutoff,) + merge_tools(T_cutoff, dbs_count, ranks, bins)
+	T_cutoff, profile_merged, bin_n = stage('merge', merge, setup=lambda: (copy.deepcopy(T),), result_digest=lambda r: digest(profile_digest(r[1]), r[2]))
+	profile_merged_mode = stage('guided_cutoff', lambda: apply_mode(profile_merged, bin_n, tax, ranks, all_ranks, mode, False), result_digest=profile_digest)
+
+	with tempfile.TemporaryDirectory() as tmp:
+		output_file = os.path.join(tmp, "output")
+		# Outputs are digested after the timed runs
+		stage('write_bioboxes', lambda: write_output(output_file + ".out", "bioboxes", taxonomy_files[1], profile_merged_mode, tax, all_ranks), result_digest=lambda r: file_digest(output_file + ".out"))
+		stage('write_tsv', lambda: write_output(output_file + ".tsv", "tsv", taxonomy_files[1], profile_merged_mode, tax, all_ranks), result_digest=lambda r: file_digest(output_file + ".tsv"))
+		stage('write_npz', lambda: write_output(output_file + ".npz", "npz", taxonomy_files[1], profile_merged_mode, tax, all_ranks), result_digest=lambda r: digest(*[v for k,v in sorted(load_npz(output_file + ".npz", False).items())]))
+		stage('write_detailed', lambda: write_detailed(output_file + ".detailed", profile_merged_mode, T_cutoff, D, tax, all_ranks), result_digest=lambda r: file_digest(output_file + ".detailed"))
+
+	settings = {'repeat': repeat, 'bins': bins, 'cutoff': cutoff, 'mode': mode}
+	return {'dataset': {'params': dataset['params'], 'seed': dataset['seed'], 'nodes': dataset['nodes']},
+			'settings': settings,
+			'environment': {'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform(), 'pandas': pandas_version()},
+			'stages': stages,
+			'digests': digests}
+
+def pandas_version():
+	try:
+		import pandas as pd
+	except ImportError:
+		return None
+	return pd.__version__
+
+def golden_entry(result):
+	# Results are comparable for the same dataset (parameters and seed) and merge settings
+	return {'params': result['dataset']['params'], 'seed': result['dataset']['seed'], 'settings': {k:v for k,v in result['settings'].items() if k!='repeat'}}
+
+def load_golden(golden_file):
+	# [{params, seed, settings, digests}]
+	if not os.path.isfile(golden_file): return []
+	with open(golden_file) as f: return json.load(f)
+
+def check_golden(result, golden_file):
+	# Returns "ok", "not available" (no golden digests for this dataset/settings) or the list of stages with different results
+	entry = golden_entry(result)
+	for golden in load_golden(golden_file):
+		if all(golden[k]==v for k,v in entry.items()):
+			changed = sorted([stage for stage, d in golden['digests'].items() if result['digests'].get(stage)!=d])
+			return changed if changed else "ok"
+	return "not available"
+
+def update_golden(result, golden_file):
+	entry = golden_entry(result)
+	golden = [g for g in load_golden(golden_file) if not all(g[k]==v for k,v in entry.items())]
+	entry['digests'] = result['digests']
+	golden.append(entry)
+	with open(golden_file, 'w') as f:
+		json.dump(golden, f, indent=1, sort_keys=True)
+		f.write("\n")
+
+def main():
+	parser = argparse.ArgumentParser(description='MetaMetaMerge benchmark - timed stages on a generated dataset')
+	parser.add_argument('-d', '--dataset', metavar='<dataset>', dest="dataset", type=str, required=True, help="Dataset folder (benchmark.generate)")
+	parser.add_argument('-o', '--output-file', metavar='<output_file>', dest="output_file", type=str, default="", help="JSON results (default: stdout)")
+	parser.add_argument('-n', '--repeat', metavar='<repeat>', dest="repeat", type=int, default=3, help="Number of runs of each stage. Default: 3")
+	parser.add_argument('-b', '--bins', metavar='<bins>', dest="bins", type=int, default=4, help="Number of bins. Default: 4")
+	parser.add_argument('-r', '--cutoff', metavar='<cutoff>', dest="cutoff", type=float, default=0.0001, help="Cutoff. Default: 0.0001")
+	parser.add_argument('-f', '--mode', metavar='<mode>', dest="mode", type=str, default="linear", help="Result mode. Default: linear")
+	parser.add_argument('-g', '--golden', metavar='<golden>', dest="golden", type=str, default=GOLDEN_FILE, help="Golden digests of the stage results. Default: benchmark/golden.json")
+	parser.add_argument('--update-golden', action='store_true', dest="update_golden", help="Store the digests of this run as golden (for this dataset and settings)")
+	args = parser.parse_args()
+
+	# Progress on stderr, JSON on stdout
+	with redirect_stdout(sys.stderr):
+		result = run_benchmark(args.dataset, args.repeat, args.bins, args.cutoff, args.mode)
+		if args.update_golden: update_golden(result, args.golden)
+		result['golden'] = check_golden(result, args.golden)
+		print("Golden check: %s" % (result['golden'] if isinstance(result['golden'], str) else "changed results on " + ", ".join(result['golden'])))
+
+	if args.output_file:
+		with open(args.output_file, 'w') as f: json.dump(result, f, indent=1, sort_keys=True)
+	else:
+		json.dump(result, sys.stdout, indent=1, sort_keys=True)
+		print()
+	return 0 if result['golden'] in ["ok", "not available"] else 1
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,113 @@
+import os, json
+from itertools import islice
+
+from metametamerge.open_file import open_file
+#from open_file import open_file
+
+# Validation of the input files without the taxonomy (standard library only, --check)
+
+# Lines read from each file
+CHECK_LINES = 1000
+
+def isnumber(value):
+	try:
+		float(value)
+		return True
+	except ValueError:
+		return False
+
+def parse_sample_sheet(sample_sheet, identifiers, methods):
+	# Tab-separated: sample_id, input files, tool identifiers [, tool methods] (comma-separated, same order)
+	# Tool identifiers should be one of the identifiers (-t) given for the database profiles, methods are taken from them if not provided
+	# Returns [(sample_id, input_files, identifiers, methods)] and a list of errors
+	samples = []
+	errors = []
+	with open(sample_sheet,'r') as f:
+		for n,line in enumerate(f,1):
+			if line[0]=="#" or not line.strip(): continue
+			fields = line.rstrip('\n').split('\t')
+			if len(fields)<3:
+				errors.append("line %d: expected sample_id, input files and tool identifiers" % n)
+				continue
+			sample_id, sample_files, sample_identifiers = fields[0], fields[1].split(","), fields[2].split(",")
+			unknown = [i for i in sample_identifiers if i not in identifiers]
+			if unknown:
+				errors.append("line %d: tool identifiers [%s] not found on the tool identifiers (-t)" % (n, ",".join(unknown)))
+				continue
+			if len(fields)>3 and fields[3]:
+				sample_methods = fields[3].split(",")
+			else:
+				sample_methods = [methods[identifiers.index(i)] for i in sample_identifiers]
+			if "-" in sample_files:
+				errors.append("line %d: stdin (-) is not supported on sample sheets" % n)
+				continue
+			if len(sample_files)!=len(sample_identifiers) or len(sample_files)!=len(sample_methods):
+				errors.append("line %d: number of input files, tool identifiers and methods should be the same" % n)
+				continue
+			samples.append((sample_id, sample_files, sample_identifiers, sample_methods))
+	return samples, errors
+
+def check_file(input_file, method):
+	# Check the path and the first lines of an input file (p -> profiling, b -> binning) or database profile (db)
+	# Returns the format (BioBoxes or tsv) and the error found (None -> ok)
+	try:
+		with open_file(input_file) as f: lines = list(islice(f, CHECK_LINES))
+	except (IOError, OSError, UnicodeDecodeError) as e:
+		return "", str(e)
+	isbiob = bool(lines) and lines[0][0] in "@#"
+	file_format = "BioBoxes" if isbiob else "tsv"
+	if method=='b':
+		# Header lines only at the beginning of the file
+		start = 0
+		while start<len(lines) and lines[start][0] in "@#\n": start+=1
+		entries = [(n,line) for n,line in enumerate(lines[start:],start+1) if line!="\n"]
+	else:
+		entries = [(n,line) for n,line in enumerate(lines,1) if line[0] not in "@#\n"]
+	if not entries: return file_format, "no entries found"
+	for n,line in entries:
+		fields = line.rstrip().split('\t')
+		if method=='b':
+			if len(fields)<3 or not fields[1].isdigit() or not fields[2].isdigit(): return file_format, "line %d: expected sequence id, taxid and length (integers)" % n
+		elif isbiob:
+			if len(fields)<5 or not isnumber(fields[4]): return file_format, "line %d: expected TAXID, RANK, TAXPATH, TAXPATHSN and PERCENTAGE (number)" % n
+		else:
+			if len(fields)!=3 or not isnumber(fields[2]): return file_format, "line %d: expected rank, taxid or name and %s (number)" % (n, "length" if method=='db' else "abundance")
+	return file_format, None
+
+def check_dmp(dmp_file):
+	# NCBI taxonomy dump: fields separated by "\t|\t"
+	try:
+		with open_file(dmp_file) as f: first_line = f.readline()
+	except (IOError, OSError, UnicodeDecodeError) as e:
+		return str(e)
+	return None if "\t|\t" in first_line else "line 1: expected fields separated by tab|tab"
+
+def check_tax_cache(cache_dir):
+	# Folder of the taxonomy cache (-x): missing, empty or a previous cache (cache.json with its version), the only ones replaced when building
+	# Returns the error found (None -> ok)
+	if not os.path.exists(cache_dir) or (os.path.isdir(cache_dir) and not os.listdir(cache_dir)): return None
+	if not os.path.isdir(cache_dir): return "taxonomy cache [%s] is not a folder" % cache_dir
+	try:
+		with open(os.path.join(cache_dir, "cache.json"),'r') as f: meta = json.load(f)
+	except (IOError, ValueError):
+		meta = None
+	if not isinstance(meta, dict) or 'version' not in meta: return "taxonomy cache [%s] is not empty and is not a taxonomy cache (cache.json not found), use an empty or new folder" % cache_dir
+	return None
+
+def check_files(jobs, dmp_files):
+	# jobs -> [(input_file, method)]. Prints the result of each file and returns the number of errors
+	errors = 0
+	print("Taxonomy: ")
+	for dmp_file in dmp_files:
+		error = check_dmp(dmp_file)
+		print(" %s %s%s" % ("ERROR" if error else "OK", dmp_file, " - " + error if error else ""))
+		if error: errors += 1
+	print("Files: ")
+	for input_file, method in jobs:
+		if input_file=="-":
+			print(" SKIPPED (%s) stdin" % method)
+			continue
+		file_format, error = check_file(input_file, method)
+		print(" %s (%s) %s%s%s" % ("ERROR" if error else "OK", method, input_file, " (%s)" % file_format if file_format else "", " - " + error if error else ""))
+		if error: errors += 1
+	return errors
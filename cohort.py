@@ -0,0 +1,96 @@
+import io, sys
+import numpy as np
+from contextlib import redirect_stdout
+
+from metametamerge.parse_files import parse_files_parallel
+from metametamerge.npz_files import save_npz, load_npz
+#from parse_files import parse_files_parallel
+#from npz_files import save_npz, load_npz
+
+# Cohort matrix (.npz, see npz_files), one taxa x samples CSR matrix for each rank:
+#  samples          sample identifiers (column -> index on samples)
+#  ranks            rank names
+#  <rank>_taxids    uint32 taxid of each row (sorted)
+#  <rank>_indptr    int64 entries of row i -> indptr[i]:indptr[i+1]
+#  <rank>_indices   uint32 sample (column) of each entry
+#  <rank>_data      float64 abundance of each entry
+# scipy.sparse.csr_matrix((data, indices, indptr), shape=(len(taxids), len(samples)))
+
+def parse_input_list(input_list):
+	# One input file per line, optionally preceded by a sample identifier (tab-separated)
+	# Returns [(sample_id, input_file)]
+	inputs = []
+	with open(input_list, 'r') as f:
+		for line in f:
+			if line[0]=="#" or not line.strip(): continue
+			fields = line.rstrip('\n').split('\t')
+			inputs.append((fields[0], fields[1]) if len(fields)>1 else (fields[0], fields[0]))
+	return inputs
+
+def read_npz_profile(input_file, tax, ranks):
+	# Merged profile written with --output-type npz as parsed profile (Presence, RankID, TaxID, Abundance)
+	npz = load_npz(input_file)
+	rankids = np.array([ranks.getRankID(r) if r in ranks.ranks else -1 for r in npz['ranks']])[npz['rank']]
+	# Align taxids with the taxonomy (merged taxids are updated, not found -> 0)
+	taxids = tax.getValidTaxIDs(npz['taxid'])
+	valid = (rankids>=0) & (taxids>0)
+	return np.column_stack([np.ones(np.sum(valid)), rankids[valid], taxids[valid], npz['abundance'][valid]])
+
+def build_cohort(input_files, names, tax, ranks, threads, verbose):
+	# Parse all merged profiles (input_files, in parallel with threads>1) and build a taxa x samples CSR matrix for each rank
+	# Entries of all samples are kept as arrays (rankid, taxid, sample, abundance) and grouped once at the end
+	# Returns {rankid: (taxids, indptr, indices, data)}
+	parsed_profiles = parse_files_parallel([(input_file,'p') for input_file in input_files if not input_file.endswith(".npz")], names, tax, ranks, verbose, threads)
+	rank_ids, taxids, samples, abundances = [], [], [], []
+	for sample, input_file in enumerate(input_files):
+		if input_file.endswith(".npz"):
+			parsed_profile = read_npz_profile(input_file, tax, ranks)
+		else:
+			# Log of each file only with verbose
+			log = io.StringIO()
+			with redirect_stdout(log):
+				parsed_profile = next(parsed_profiles)
+			if verbose: sys.stdout.write(log.getvalue())
+		parsed_profile = np.asarray(parsed_profile).reshape(-1,4)
+		rank_ids.append(parsed_profile[:,1].astype(np.uint8))
+		taxids.append(parsed_profile[:,2].astype(np.uint32))
+		samples.append(np.full(parsed_profile.shape[0], sample, dtype=np.uint32))
+		abundances.append(parsed_profile[:,3])
+		if (sample+1)%1000==0: print("\t%d samples parsed" % (sample+1))
+
+	rank_ids = np.concatenate(rank_ids + [np.zeros(0, dtype=np.uint8)])
+	taxids = np.concatenate(taxids + [np.zeros(0, dtype=np.uint32)])
+	samples = np.concatenate(samples + [np.zeros(0, dtype=np.uint32)])
+	abundances = np.concatenate(abundances + [np.zeros(0)])
+
+	matrix = {}
+	for rankid in ranks.getIDs():
+		r = rank_ids==rankid
+		# Sort by taxid (row) and sample (column)
+		order = np.lexsort((samples[r], taxids[r]))
+		rank_taxids, rank_samples, rank_abundances = taxids[r][order], samples[r][order], abundances[r][order]
+		# Sum repeated entries of the same taxid and sample (e.g. merged taxids)
+		if rank_taxids.shape[0]:
+			starts = np.flatnonzero(np.concatenate([[True], (rank_taxids[1:]!=rank_taxids[:-1]) | (rank_samples[1:]!=rank_samples[:-1])]))
+			rank_abundances = np.add.reduceat(rank_abundances, starts)
+			rank_taxids, rank_samples = rank_taxids[starts], rank_samples[starts]
+		row_taxids, row_counts = np.unique(rank_taxids, return_counts=True)
+		indptr = np.concatenate([[0], np.cumsum(row_counts)]).astype(np.int64)
+		matrix[rankid] = (row_taxids.astype(np.uint32), indptr, rank_samples, rank_abundances)
+		print("\t%s - %d taxa, %d entries" % (ranks.getRankName(rankid), row_taxids.shape[0], rank_samples.shape[0]))
+	return matrix
+
+def write_cohort(output_file, matrix, sample_ids, ranks):
+	arrays = {'samples': np.array(sample_ids), 'ranks': np.array(ranks.ranks)}
+	for rankid, (taxids, indptr, indices, data) in matrix.items():
+		rank_name = ranks.getRankName(rankid)
+		arrays[rank_name + "_taxids"] = taxids
+		arrays[rank_name + "_indptr"] = indptr
+		arrays[rank_name + "_indices"] = indices
+		arrays[rank_name + "_data"] = data
+	save_npz(output_file, arrays)
+
+def load_cohort(input_file, mmap=True):
+	# Returns the sample identifiers and {rank name: (taxids, indptr, indices, data)}
+	arrays = load_npz(input_file, mmap)
+	return arrays['samples'], {rank_name: tuple(arrays[rank_name + c] for c in ["_taxids","_indptr","_indices","_data"]) for rank_name in arrays['ranks']}
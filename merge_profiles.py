@@ -0,0 +1,66 @@
+import numpy as np
+
+from metametamerge.Profile import Profile
+#from Profile import Profile
+
+def merge_profiles(T, dbs_count, ranks, bins):
+	# Merge the profiles of all tools (T) by (taxid,rankid)
+	# dbs_count -> (taxids, counts) number of database profiles with each taxid (count_databases)
+	# Returns a Profile with Presence set to the bin number (1...bins) of the score of each taxon and the harmonic mean of its abundances, and the number of bins
+	return bin_profiles(group_profiles(T, dbs_count), len(T), ranks, bins)
+
+def group_profiles(T, dbs_count):
+	# Group the entries of all tools by (taxid,rankid), independent of the number of bins
+	# Returns arrays (rankid, taxid, presence, score, harmonic mean abundance) following the order of their first occurrence on the tools (as when merging them one by one)
+	rank_ids = []
+	taxids = []
+	abundances = []
+	for tool in T:
+		for rankid,profilerank in tool:
+			rank_ids.append(np.repeat(rankid, profilerank.getSize()))
+			taxids.append(profilerank.getCol('TaxID'))
+			abundances.append(profilerank.getCol('Abundance'))
+	rank_ids = np.concatenate(rank_ids + [np.zeros(0, dtype=int)]).astype(np.int64)
+	taxids = np.concatenate(taxids + [np.zeros(0, dtype=np.uint32)])
+	abundances = np.concatenate(abundances + [np.zeros(0)])
+
+	# Group entries by (taxid,rankid)
+	keys = taxids.astype(np.int64) * (int(rank_ids.max())+1 if rank_ids.shape[0] else 1) + rank_ids
+	_, first_idx, group, presence = np.unique(keys, return_index=True, return_inverse=True, return_counts=True)
+	group = group.reshape(-1)
+	# Order groups by first occurrence
+	group_order = np.argsort(first_idx, kind='stable')
+	group_rank = np.empty_like(group_order)
+	group_rank[group_order] = np.arange(group_order.shape[0])
+	group = group_rank[group]
+	presence = presence[group_order]
+	first_idx = first_idx[group_order]
+
+	# Score: (presence+1)^2/(number of database profiles with the taxid + 1)
+	db_taxids, db_counts = dbs_count
+	merged_taxids = taxids[first_idx]
+	merged_ranks = rank_ids[first_idx]
+	pos = np.minimum(np.searchsorted(db_taxids, merged_taxids), max(db_taxids.shape[0]-1,0))
+	merged_db_counts = np.where(db_taxids[pos]==merged_taxids, db_counts[pos], 0) if db_taxids.shape[0] else np.zeros(merged_taxids.shape[0], dtype=np.int64)
+	scores = ((presence+1)**2)/(merged_db_counts+1).astype(np.float64)
+
+	# Harmonic mean of the abundances, summing the inverses sequentially on the order of the tools
+	entries = np.argsort(group, kind='stable')
+	group_start = np.concatenate([[0], np.cumsum(presence)[:-1]]).astype(np.int64)
+	with np.errstate(divide='ignore'):
+		inverses = 1. / abundances[entries]
+		sum_inverses = np.zeros(presence.shape[0])
+		for i in range(presence.max() if presence.shape[0] else 0):
+			g = presence>i
+			sum_inverses[g] = sum_inverses[g] + inverses[group_start[g]+i]
+		hmean = presence / sum_inverses
+
+	return merged_ranks, merged_taxids, presence, scores, hmean
+
+def bin_profiles(groups, n_tools, ranks, bins):
+	# Divide scores range into bin groups and create a Profile with them (groups from group_profiles of n_tools)
+	merged_ranks, merged_taxids, _, scores, hmean = groups
+	_, bin_edges = np.histogram(scores, bins=bins, range=(0,n_tools+1))
+	merged_bins = np.digitize(scores, bin_edges, right=True)
+	profile_merged = np.column_stack([merged_bins, merged_ranks, merged_taxids, hmean]).astype(np.float64)
+	return Profile(profile_merged, ranks), len(bin_edges)-1
@@ -0,0 +1,83 @@
+import json, sys, time, resource, tracemalloc, cProfile
+from contextlib import contextmanager
+
+# --metrics: wall time, CPU time, memory and number of entries (rows_in/rows_out) of each stage and input file (JSON)
+# Memory: current and peak RSS of the process (peak_rss_mb is the high-water mark up to the end of the stage) and the peak of python allocations during the stage (tracemalloc, optional)
+
+def rss_mb():
+	# Current resident memory (Linux), None if not available
+	try:
+		with open("/proc/self/statm") as f:
+			return int(f.read().split()[1]) * resource.getpagesize() / 2**20
+	except (IOError, ValueError, IndexError):
+		return None
+
+def peak_rss_mb():
+	# ru_maxrss -> kilobytes (Linux), bytes (macOS)
+	peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	return peak / 2**20 if sys.platform=="darwin" else peak / 2**10
+
+class Metrics:
+
+	def __init__(self, trace_memory=False, profile_stage="", profile_file=""):
+		# profile_stage -> cProfile this stage, writing the stats (pstats) to profile_file
+		self.stages = []
+		self.files = []
+		self.trace_memory = trace_memory
+		self.profile_stage = profile_stage
+		self.profile_file = profile_file
+		# Measurements in progress (nested), to keep their tracemalloc peak when a nested one resets it
+		self.running = []
+		if trace_memory and not tracemalloc.is_tracing(): tracemalloc.start()
+		self.start = (time.perf_counter(), time.process_time())
+
+	def foldPeak(self):
+		peak = tracemalloc.get_traced_memory()[1]
+		for record in self.running: record['tracemalloc_peak_mb'] = max(record['tracemalloc_peak_mb'], peak / 2**20)
+		# Without reset_peak (python<3.9) the peak is the one since the start of the run
+		if hasattr(tracemalloc, 'reset_peak'): tracemalloc.reset_peak()
+
+	@contextmanager
+	def measure(self, record, profile=False):
+		# Measure the block into record (the caller can add rows_in/rows_out)
+		if self.trace_memory:
+			self.foldPeak()
+			record['tracemalloc_peak_mb'] = 0
+		self.running.append(record)
+		profiler = cProfile.Profile() if profile else None
+		wall, cpu = time.perf_counter(), time.process_time()
+		if profiler: profiler.enable()
+		try:
+			yield record
+		finally:
+			if profiler:
+				profiler.disable()
+				profiler.dump_stats(self.profile_file)
+				record['profile'] = self.profile_file
+			record['wall_seconds'] = time.perf_counter() - wall
+			record['cpu_seconds'] = time.process_time() - cpu
+			record['rss_mb'] = rss_mb()
+			# ru_maxrss may lag behind the current RSS
+			record['peak_rss_mb'] = max(peak_rss_mb(), record['rss_mb'] or 0)
+			if self.trace_memory: self.foldPeak()
+			self.running.remove(record)
+
+	def stage(self, name):
+		record = {'stage': name}
+		self.stages.append(record)
+		return self.measure(record, name==self.profile_stage)
+
+	def file(self, input_file, method):
+		record = {'file': input_file, 'method': method}
+		self.files.append(record)
+		return self.measure(record)
+
+	def addFile(self, record):
+		# File measured in another process (parse_files_parallel)
+		self.files.append(record)
+
+	def save(self, output_file, info={}):
+		total = {'wall_seconds': time.perf_counter() - self.start[0], 'cpu_seconds': time.process_time() - self.start[1], 'peak_rss_mb': peak_rss_mb()}
+		with open(output_file, 'w') as f:
+			json.dump(dict(info, total=total, stages=self.stages, files=self.files), f, indent=1)
+			f.write("\n")
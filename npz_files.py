@@ -0,0 +1,54 @@
+import zipfile
+import numpy as np
+
+# Binary output (--output-type npz): uncompressed NumPy .npz, one column per member
+#  ranks      rank names (rank -> index on ranks)
+#  rank       uint8
+#  taxid      uint32
+#  abundance  float64
+#  presence   uint16 (bin on the merged profile)
+# Detailed output (.detailed.npz): the same members + tools (identifiers) and detailed (float64 entries x tools: abundance, 0 -> not identified but present in the database, -1 -> not present in the database)
+# Cohort matrix (MetaMetaCohort.py): see cohort.py
+
+def save_npz(output_file, arrays):
+	# Members are stored (not compressed) so they can be memory mapped by load_npz
+	with open(output_file, 'wb') as f:
+		np.savez(f, **arrays)
+
+def load_npz(input_file, mmap=True):
+	# Returns {member: array}, memory mapping the members directly from the .npz (mmap=True)
+	if not mmap:
+		with np.load(input_file) as npz:
+			return {k:npz[k] for k in npz.files}
+	arrays = {}
+	with zipfile.ZipFile(input_file) as z, open(input_file, 'rb') as f:
+		for info in z.infolist():
+			name = info.filename[:-4] if info.filename.endswith(".npy") else info.filename
+			if info.compress_type!=zipfile.ZIP_STORED:
+				arrays[name] = np.load(z.open(info))
+				continue
+			# Local file header: fixed 30 bytes + file name + extra field
+			f.seek(info.header_offset + 26)
+			name_len, extra_len = np.frombuffer(f.read(4), dtype='<u2')
+			f.seek(info.header_offset + 30 + int(name_len) + int(extra_len))
+			version = np.lib.format.read_magic(f)
+			if version not in [(1,0),(2,0)]:
+				arrays[name] = np.load(z.open(info))
+				continue
+			shape, fortran_order, dtype = (np.lib.format.read_array_header_1_0 if version==(1,0) else np.lib.format.read_array_header_2_0)(f)
+			if dtype.hasobject or not np.prod(shape):
+				arrays[name] = np.load(z.open(info))
+			else:
+				arrays[name] = np.memmap(input_file, dtype=dtype, mode='r', offset=f.tell(), shape=shape, order='F' if fortran_order else 'C')
+	return arrays
+
+def profile_arrays(profile, ranks):
+	# Columns of a Profile (in order) with the rank names of its rankids
+	rank = []
+	for rankid, profilerank in profile:
+		rank.append(np.full(profilerank.getSize(), rankid, dtype=np.uint8))
+	return {'ranks': np.array(ranks.ranks),
+			'rank': np.concatenate(rank + [np.zeros(0, dtype=np.uint8)]),
+			'taxid': profile.getCol('TaxID'),
+			'abundance': profile.getCol('Abundance'),
+			'presence': profile.getCol('Presence')}
@@ -0,0 +1,78 @@
+import io, sys, shutil, subprocess, threading
+import gzip, bz2, lzma
+
+# magic bytes -> (external decompressors, python module opener)
+# External decompressors run in a background process, overlapping decompression with parsing
+compression_formats = {
+	'gzip': (b'\x1f\x8b', [['pigz','-dc'],['gzip','-dc']], gzip.open),
+	'bz2': (b'BZh', [['lbzip2','-dc'],['pbzip2','-dc'],['bzip2','-dc']], bz2.open),
+	'xz': (b'\xfd7zXZ\x00', [['xz','-dc','-T0'],], lzma.open),
+	'zstd': (b'\x28\xb5\x2f\xfd', [['zstd','-dc'],], None),
+}
+
+class ProcessReader(io.BufferedReader):
+	# Read the output (stdout) of a decompressor process
+	# file -> path or binary file object (e.g. stdin), fed to the process by a thread
+	def __init__(self, cmd, file):
+		if isinstance(file, str):
+			self.proc = subprocess.Popen(cmd + [file], stdout=subprocess.PIPE, bufsize=0)
+		else:
+			self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, bufsize=0)
+			threading.Thread(target=self.feed, args=(file,), daemon=True).start()
+		io.BufferedReader.__init__(self, self.proc.stdout, buffer_size=1024*1024)
+		self.cmd = cmd
+
+	def feed(self, file):
+		try:
+			shutil.copyfileobj(file, self.proc.stdin, 1024*1024)
+		except (BrokenPipeError, ValueError): # Process terminated (closed before the end of the file)
+			pass
+		finally:
+			try:
+				self.proc.stdin.close()
+			except BrokenPipeError:
+				pass
+
+	def close(self):
+		if self.closed: return
+		io.BufferedReader.close(self)
+		if self.proc.poll() is None: # Closed before the end of the file
+			self.proc.terminate()
+			self.proc.wait()
+		elif self.proc.returncode>0:
+			raise IOError("%s failed (exit status %d)" % (' '.join(self.cmd), self.proc.returncode))
+
+def get_compression(file):
+	with open(file,'rb') as f: magic = f.read(6)
+	for compression,(compression_magic,_,_) in compression_formats.items():
+		if magic.startswith(compression_magic): return compression
+	return None
+
+def open_compressed(file, compression):
+	# file -> path or binary file object
+	_, cmds, opener = compression_formats[compression]
+	for cmd in cmds:
+		if shutil.which(cmd[0]): return ProcessReader(cmd, file)
+	if opener: return opener(file, 'rb')
+	try:
+		import zstandard
+	except ImportError:
+		raise IOError("%s is compressed with %s: zstd or the python package zstandard is required" % (file if isinstance(file, str) else "stdin", compression))
+	return zstandard.open(file, 'rb')
+
+def open_stdin():
+	stdin = sys.stdin.buffer
+	magic = stdin.peek(6)[:6]
+	for compression,(compression_magic,_,opener) in compression_formats.items():
+		if magic.startswith(compression_magic): return opener(stdin, 'rb') if opener else open_compressed(stdin, compression)
+	return stdin
+
+def open_file(file, mode='r'):
+	# Open plain or compressed (gzip, bz2, xz, zstd - detected by magic bytes) files for reading. - reads from stdin
+	# mode: 'r' (text) or 'rb' (binary)
+	if file=="-":
+		f = open_stdin()
+	else:
+		compression = get_compression(file)
+		f = open_compressed(file, compression) if compression else open(file,'rb')
+	return f if mode=='rb' else io.TextIOWrapper(f, encoding='utf-8')
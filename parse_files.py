@@ -1,142 +1,238 @@
 import numpy as np
+import io, sys, csv, multiprocessing, tracemalloc
+from contextlib import redirect_stdout, nullcontext
 from collections import defaultdict
 
-def parse_files(input_file, method, all_names_scientific, all_names_other, nodes, merged, ranks, verbose):
+from metametamerge.open_file import open_file
+from metametamerge.NameIndex import NameIndex
+from metametamerge.metrics import Metrics
+#from open_file import open_file
+#from NameIndex import NameIndex
+#from metrics import Metrics
+
+# Bytes of the binning file read at once (memory usage depends on this and not on the file size)
+BINNING_CHUNK_SIZE = 64*1024*1024
+
+# pandas (faster parsing, optional) is imported with the first parsed file: False -> not imported yet, None -> not available
+pandas_module = False
+
+def load_pandas():
+	global pandas_module
+	if pandas_module is False:
+		try:
+			import pandas
+			pandas_module = pandas
+		except ImportError:
+			pandas_module = None
+	return pandas_module
+
+def isbioboxes(input_file):
+	with open_file(input_file) as f: first_line = f.readline()
+	return True if first_line.startswith("@") or first_line.startswith("#") else False
+
+def profiling_entries(input_file, isbiob):
+	# Yield (taxid, name, rank, abundance) of each entry of a profiling file (taxid 0 -> not given)
+	with open_file(input_file) as f:
+		for line in f:
+			if isbiob:
+				if line[0]=="@" or line[0]=="#" or line[0]=="\n": continue
+				fields = line.rstrip().split('\t')
+				taxid = int(fields[0]) if fields[0].isdigit() else 0 
+				rank = fields[1]
+				name = fields[3].split("|")[-1]
+				ab = fields[4]
+			else:
+				rank, name_taxid, ab = line.rstrip().split('\t')
+				taxid = int(name_taxid) if name_taxid.isdigit() else 0
+				name = name_taxid if not name_taxid.isdigit() else ""
+			yield taxid, name, rank, ab
+
+def parse_binning_chunk(lines, pd):
+	# lines -> taxid and length columns as integer arrays
+	if pd: # PANDAS implementation - faster
+		try:
+			binning = pd.read_csv(io.BytesIO(b"".join(lines)), sep="\t", header=None, usecols=[1,2], dtype=np.int64).values
+		except pd.errors.EmptyDataError: # only empty lines
+			binning = np.zeros((0,2), dtype=np.int64)
+		return binning[:,0], binning[:,1]
+	else:
+		taxids = []
+		lens = []
+		for line in lines:
+			if line[0:1]==b"\n": continue
+			fields = line.rstrip().split(b'\t')
+			taxids.append(int(fields[1]))
+			lens.append(int(fields[2]))
+		return np.array(taxids, dtype=np.int64), np.array(lens, dtype=np.int64)
+
+def binning_chunks(input_file, pd):
+	# Yield the taxid and length columns of a binning file (integer arrays), reading BINNING_CHUNK_SIZE bytes at once
+	f = open_file(input_file,'rb')
+	header = True
+	while True:
+		lines = f.readlines(BINNING_CHUNK_SIZE)
+		if not lines: break
+		if header: # Skip header lines (only at the beginning of the file)
+			start = 0
+			while start<len(lines) and lines[start][0:1] in (b"@",b"#",b"\n"): start+=1
+			lines = lines[start:]
+			if not lines: continue
+			header = False
+		yield parse_binning_chunk(lines, pd)
+	f.close()
+
+def binning_to_profile(binning_result, tax, ranks):
+	# Binning to Profiling: binning_result -> [taxid, summed length] (unique valid taxids)
+	count = defaultdict(int)
+	result = [np.zeros((0,4))]
+	if binning_result.size:
+		# Lengths already summed by taxid (leafs)
+		leaf_taxids = binning_result[:,0].astype(int)
+		leaf_len = binning_result[:,1]
+
+		# Sum up the lengths of the leafs to their ancestors on each choosen rank (lineage includes the leaf itself)
+		# Other ranks are ignored here but their counts are summed up to the valid ranks
+		lineage = tax.getLineage(leaf_taxids)
+		for rank in ranks.ranks:
+			ancestors = lineage[:,tax.getLineageRankID(rank)]
+			valid = ancestors>0
+			rank_taxids, rank_idx = np.unique(ancestors[valid], return_inverse=True)
+			rank_len = np.bincount(rank_idx, weights=leaf_len[valid])
+			count[rank] = rank_taxids.shape[0]
+			result.append(np.column_stack([np.ones(count[rank]), np.repeat(ranks.getRankID(rank),count[rank]), rank_taxids, rank_len]))
+
+	return np.vstack(result), count
+
+def parse_files(input_file, method, names, tax, ranks, verbose, stats=None, memo=None):
+	# stats -> dict updated with the number of entries read (rows_in) and parsed (rows_out)
+	# memo -> resolved (taxid, name, rank) entries, shared by the files of one merge (same names and tax). None -> only for this file
+	pd = load_pandas()
+	if memo is None: memo = {}
 	
-	def retrieveValidTaxID(taxid, name=None, rank=None):
+	def retrieveValidTaxID(memo, taxid, name=None, rank=None):
+		# Repeated entries are resolved only once
+		key = (taxid, name, rank)
+		if key not in memo: memo[key] = resolveTaxID(taxid, name, rank)
+		return memo[key]
+
+	def resolveTaxID(taxid, name=None, rank=None):
 		# Normalize taxids into one single version of the taxonomic database (one provided as a parameter)
 		# 1) Look up for the taxid (nodes.dmp), meaning it's still valid
 		# 2) Look up for changes in the taxid (merged.dmp) and return updated version (check if rank is still valid)
 		# 3) Look up for scientific name (names.dmp), return only if find unique match
 		# 4) Look up for any other taxonomic name (names.dmp), return only if find unique match
 		if taxid:
-			if taxid in nodes: # Valid taxid
+			if taxid in tax: # Valid taxid
 				return taxid
-			elif taxid in merged: # Search for updated taxid on merged.dmp
-				if verbose: print(("(WARNING) merged taxid [%d] -> [%d] rank [%s]") % (taxid, merged[taxid], nodes[merged[taxid]]['rank']))
-				return merged[taxid]
+			elif tax.getMerged(taxid): # Search for updated taxid on merged.dmp
+				if verbose: print(("(WARNING) merged taxid [%d] -> [%d] rank [%s]") % (taxid, tax.getMerged(taxid), tax.getRank(tax.getMerged(taxid))))
+				return tax.getMerged(taxid)
 		
-		# If there's no valid taxid, look for name
+		# If there's no valid taxid, look for name (case and whitespace insensitive)
 		if name and rank:
-			if (name,rank) in all_names_scientific:
-				# First look for scientific names
-				if len(all_names_scientific[(name,rank)])>1: #Name found but with more than one taxid (ambiguous)
-					if verbose: print(("Ignored entry [%s] rank [%s] - ambiguous scientific name" % (name,rank)))
+			# First look for scientific names, then for non-scientific names
+			for table in NameIndex.tables:
+				name_taxid = names.lookup(table, name, rank)
+				if name_taxid==0: #Name found but with more than one taxid (ambiguous)
+					if verbose: print(("Ignored entry [%s] rank [%s] - ambiguous %s" % (name,rank,"scientific name" if table=="scientific" else "name")))
 					return 0
-				else:
-					return all_names_scientific[(name,rank)][0] # Unique name found, return taxid
-			elif (name,rank) in all_names_other:
-				# Check for non-scientific names
-				if len(all_names_other[(name,rank)])>1: #Name found but with more than one taxid (ambiguous)
-					if verbose: print(("Ignored entry [%s] rank [%s] - ambiguous name" % (name,rank)))
-					return 0
-				else:
-					return all_names_other[(name,rank)][0] # Unique name found, return taxid
+				elif name_taxid:
+					return name_taxid # Unique name found, return taxid
 
 		if verbose: print(("Ignored entry [%s] rank [%s] - Taxid and name not found" % (taxid if taxid else name,rank)))
 		return 0
 
+	def validate_entry(taxid, name, rank):
+		# Valid taxid of a profiling entry, 0 -> ignored
+		# Verify if rank is valid -> only on profiling (binning is kept to account for the abundance estimation)
+		if rank not in ranks.ranks: 
+			if verbose: print(("Ignored entry [%s] rank [%s] - Rank not expected" % (taxid if taxid else name,rank)))
+			return 0
+		valid_taxid = retrieveValidTaxID(memo, taxid, name, rank)
+		#If taxid changed, re-check rank
+		if valid_taxid and valid_taxid!=taxid and tax.getRank(valid_taxid) not in ranks.ranks:
+			if verbose: print(("Ignored entry [%s] rank [%s] - Rank not expected" % (taxid if taxid else name,rank)))
+			return 0
+		return valid_taxid
+
 	def parse_profiling(input_file, isbiob):
 		result = []
 		count = defaultdict(lambda: {'total':0,'ignored':0})
-		with open(input_file,'r') as f:
-			for line in f:
-				if isbiob:
-					if line[0]=="@" or line[0]=="#" or line[0]=="\n": continue
-					fields = line.rstrip().split('\t')
-					taxid = int(fields[0]) if fields[0].isdigit() else 0 
-					rank = fields[1]
-					name = fields[3].split("|")[-1]
-					ab = fields[4]
-				else:
-					rank, name_taxid, ab = line.rstrip().split('\t')
-					taxid = int(name_taxid) if name_taxid.isdigit() else 0
-					name = name_taxid if not name_taxid.isdigit() else ""
-				
-				# Verify if rank is valid -> only on profiling (binning is kept to account for the abundance estimation)
-				if rank not in ranks.ranks: 
-					if verbose: print(("Ignored entry [%s] rank [%s] - Rank not expected" % (taxid if taxid else name,rank)))
-					count[rank]['ignored']+=1
-				else:
-					valid_taxid = retrieveValidTaxID(taxid, name, rank)
-					#If taxid changed, re-check rank
-					if valid_taxid:
-						if valid_taxid!=taxid and nodes[valid_taxid]['rank'] not in ranks.ranks:
-							if verbose: print(("Ignored entry [%s] rank [%s] - Rank not expected" % (taxid if taxid else name,rank)))
-							count[rank]['ignored']+=1
-						else:
-							result.append([1,ranks.getRankID(rank), valid_taxid, float(ab)])
-							count[rank]['total']+=1
-					else:
-						count[rank]['ignored']+=1
+		for taxid, name, rank, ab in profiling_entries(input_file, isbiob):
+			valid_taxid = validate_entry(taxid, name, rank)
+			if valid_taxid:
+				result.append([1,ranks.getRankID(rank), valid_taxid, float(ab)])
+				count[rank]['total']+=1
+			else:
+				count[rank]['ignored']+=1
 
 		return np.array(result), count
+
+	def parse_profiling_bulk(input_file, isbiob):
+		# PANDAS implementation: columns are read at once and entries with valid taxids (nodes.dmp) and ranks are checked vectorized
+		# All other entries (merged taxids, names, unexpected ranks) are validated one by one on the file order (same log and counts as parse_profiling)
+		count = defaultdict(lambda: {'total':0,'ignored':0})
+		n_cols = 5 if isbiob else 3
+		try:
+			with open_file(input_file,'rb') as f:
+				profile = pd.read_csv(f, sep="\t", header=None, names=range(n_cols), usecols=[0,1,3,4] if isbiob else [0,1,2], dtype=str, quoting=csv.QUOTE_NONE, na_filter=False, index_col=False)
+		except pd.errors.EmptyDataError:
+			return np.array([]), count
+		if isbiob:
+			profile = profile[~profile[0].str[:1].isin(["@","#"]).values]
+			taxid_col, rank_col, ab_col = profile[0], profile[1], profile[4]
+		else:
+			rank_col, taxid_col, ab_col = profile[0], profile[1], profile[2]
+
+		isdigit = taxid_col.str.isdigit().values.astype(bool)
+		taxids = np.zeros(len(profile), dtype=np.int64)
+		taxids[isdigit] = taxid_col.values[isdigit].astype(np.int64)
+		# Ranks are checked once for each distinct rank (codes -> index on rank_names)
+		codes, rank_names = pd.factorize(rank_col)
+		rank_names = list(rank_names)
+		valid_taxids = tax.getValidTaxIDs(taxids)
+		valid = np.array([rank in ranks.ranks for rank in rank_names], dtype=bool)[codes] & (taxids>0) & (valid_taxids==taxids)
+		for i in np.flatnonzero(~valid).tolist():
+			if isbiob: name = profile[3].values[i].split("|")[-1]
+			else: name = taxid_col.values[i] if not isdigit[i] else ""
+			valid_taxids[i] = validate_entry(int(taxids[i]), name, rank_names[codes[i]])
+			valid[i] = valid_taxids[i]!=0
+
+		for rank, total, ignored in zip(rank_names, np.bincount(codes[valid], minlength=len(rank_names)).tolist(), np.bincount(codes[~valid], minlength=len(rank_names)).tolist()):
+			count[rank]['total']+=total
+			count[rank]['ignored']+=ignored
+		if not np.any(valid): return np.array([]), count
+		rankids = np.array([ranks.getRankID(rank) if rank in ranks.ranks else 0 for rank in rank_names])[codes[valid]]
+		return np.column_stack([np.ones(rankids.shape[0]), rankids, valid_taxids[valid], ab_col.values[valid].astype(np.float64)]), count
 		
 	def parse_binning(input_file):
-		try: # PANDAS implementation - faster
-			import pandas as pd
-			count = {'total':0,'ignored':0}
-			header_count=0
-			for line in open(input_file,'r'):
-				if line[0]=="@" or line[0]=="#" or line[0]=="\n": header_count+=1
-				else: break
-			pandas_parsed = pd.read_csv(input_file, sep="\t", header=None, skiprows=header_count, names=('taxid','len'), usecols=[1,2], converters={'taxid': lambda txid: retrieveValidTaxID(int(txid))}, dtype={'len':int})
-			count['total'] = pandas_parsed.shape[0]
-			result = pandas_parsed[pandas_parsed.taxid!=0]
-			count['ignored'] = count['total'] - result.shape[0]
-			if verbose: 
-				for row in pandas_parsed[pandas_parsed.taxid==0].itertuples(): print(("Ignored entry [%s] - Taxid not found" % (row.taxid)))
-		except:	
-			if verbose: print("(WARNING) pandas parsing failed")
-			result = []
-			count = {'total':0,'ignored':0}
-			with open(input_file,'r') as f:
-				for line in f:
-					if line[0]=="@" or line[0]=="#" or line[0]=="\n": continue
-					fields = line.rstrip().split('\t')
-					taxid = int(fields[1])
-					len = fields[2]
-					count['total']+=1
-					valid_taxid = retrieveValidTaxID(taxid)
-					if valid_taxid: # Add taxid to results
-						result.append([int(valid_taxid),int(len)])
-					else:
-						count['ignored']+=1
-						if verbose: print(("Ignored entry [%s] - Taxid not found" % (taxid)))
-		# result = [taxid, len]
-		return np.array(result), count
-
-	def b2p(binning_result):# Binning to Profiling
-		# Sum read lengths for each entry (by taxid)
-		leaf_len = defaultdict(int)
-		for br in binning_result: leaf_len[br[0]]+=br[1]
-	
-		# From the counts (only leafs) reconstruct the taxonomic tree, summing up lengths to higher taxonomic levels
-		for taxid,len in list(leaf_len.items()):
-			#Start from the parent node because the entry itself (leaf) already contains the count
-			txid = nodes[taxid]['parent']
-			nlen = int(len)
-			while txid!=1: # Until root node
-				nlen = leaf_len[txid] + nlen # New length account for node accumulated length plus parent length
-				leaf_len[txid] = nlen # Add new lenght to the parent
-				txid = nodes[txid]['parent'] # Set next node
+		# Stream the file in chunks, keeping only the summed length and number of reads by taxid (0 -> ignored entries)
+		count = {'total':0,'ignored':0}
+		reads = np.zeros(tax.parent.shape[0], dtype=np.int64)
+		sum_lens = np.zeros(tax.parent.shape[0], dtype=np.float64)
+		merged_taxids = set()
+		ignored_taxids = set()
+		for taxids, lens in binning_chunks(input_file, pd):
+			# Check/update all taxids at once (0 -> not found)
+			valid_taxids = tax.getValidTaxIDs(taxids)
+			count['total'] += taxids.shape[0]
+			count['ignored'] += int(np.sum(valid_taxids==0))
+			if verbose:
+				merged_taxids.update(np.unique(taxids[(valid_taxids!=taxids) & (valid_taxids!=0)]).tolist())
+				ignored_taxids.update(np.unique(taxids[valid_taxids==0]).tolist())
+			
+			reads += np.bincount(valid_taxids, minlength=reads.shape[0])
+			sum_lens += np.bincount(valid_taxids, weights=lens, minlength=sum_lens.shape[0])
 		
-		# Generate the profile
-		count = defaultdict(int)
-		result = []
-		for taxid,len in leaf_len.items():
-			rank = nodes[taxid]['rank']
-			# Only keep choosen ranks - They are ignored here but their counts were already summed up to the valid ranks
-			if rank in ranks.ranks:
-				count[rank]+=1
-				result.append([1,ranks.getRankID(rank),taxid,float(len)])
+		if verbose:
+			for taxid in sorted(merged_taxids): print(("(WARNING) merged taxid [%d] -> [%d] rank [%s]") % (taxid, tax.getMerged(taxid), tax.getRank(tax.getMerged(taxid))))
+			for taxid in sorted(ignored_taxids): print(("Ignored entry [%s] - Taxid not found" % (taxid)))
 		
-		return np.array(result), count
-	
-	def isbioboxes(input_file):
-		with open(input_file, 'r') as f: first_line = f.readline()
-		return True if first_line.startswith("@") or first_line.startswith("#") else False
-	
+		reads[0] = 0
+		valid_taxids = np.flatnonzero(reads)
+		# result = [taxid, len] (unique taxids)
+		return np.column_stack([valid_taxids, sum_lens[valid_taxids]]), count
+
 	#######################################################################
 	
 	if method=='db' or method=='p':
@@ -144,23 +240,96 @@ def parse_files(input_file, method, all_names_scientific, all_names_other, nodes
 		if isbiob: print(" - %s (BioBoxes)" % input_file)
 		else: print(" - %s (tsv)" % input_file)
 		
-		parsed_profile, profile_count = parse_profiling(input_file, isbiob)
+		if verbose and not pd: print("(WARNING) pandas not available, parsing line by line")
+		parsed_profile, profile_count = parse_profiling_bulk(input_file, isbiob) if pd else parse_profiling(input_file, isbiob)
 		for rank in ranks.ranks: 
 			print(("\t%s - %d entries (%d ignored)") % (rank, profile_count[rank]['total'], profile_count[rank]['ignored']))
 			# Just warn user because lack of a rank can happen (when lineage is not well described)
 			if profile_count[rank]['total']-profile_count[rank]['ignored']==0: print(("\t(WARNING) no valid entries found [%s]") % (rank))
+		rows_in = sum([c['total']+c['ignored'] for c in profile_count.values()])
 
 	elif method=='b':
-		if isbioboxes(input_file): print(" - %s (BioBoxes)" % input_file)
+		if input_file=="-": print(" - stdin")
+		elif isbioboxes(input_file): print(" - %s (BioBoxes)" % input_file)
 		else: print(" - %s (tsv)" % input_file)
 		
+		if verbose and not pd: print("(WARNING) pandas not available, parsing line by line")
 		binning_result, binning_count = parse_binning(input_file)
 		print(("\t%d lines (%d ignored)") % (binning_count['total'], binning_count['ignored']))
 		
-		parsed_profile, profile_count = b2p(binning_result)
+		parsed_profile, profile_count = binning_to_profile(binning_result, tax, ranks)
 		for rank in ranks.ranks: 
 			print(("\t%s - %d entries") % (rank, profile_count[rank]))
 			if profile_count[rank]==0: print(("\t(WARNING) no valid entries found [%s]") % (rank))
+		rows_in = binning_count['total']
 
+	if stats is not None: stats.update(rows_in=rows_in, rows_out=len(parsed_profile))
 	#parsed_profile = np.array([Presence,RankID,TaxID,Val])
 	return parsed_profile
+
+# Arguments shared with the pool processes (inherited on fork, not pickled)
+pool_args = None
+pool_memo = None
+
+def parse_files_job(input_file, method, measure):
+	# Parse one file capturing its log (and its metrics, measured on the pool process)
+	log = io.StringIO()
+	metrics = Metrics(tracemalloc.is_tracing()) if measure else None
+	with redirect_stdout(log), (metrics.file(input_file, method) if measure else nullcontext()) as stats:
+		parsed_profile = parse_files(input_file, method, *pool_args, stats=stats, memo=pool_memo)
+	return parsed_profile, log.getvalue(), stats
+
+def parse_files_parallel(jobs, names, tax, ranks, verbose, threads, metrics=None, memo=None):
+	# jobs -> [(input_file, method)]
+	# Yield the parsed profiles in the same order of the jobs, printing the log of each file just before
+	# metrics -> Metrics: measure each file
+	# memo -> resolved entries shared by the files of one merge (see parse_files), None -> shared by the jobs. Each pool process resolves on its own copy
+	if memo is None: memo = {}
+	def measure_file(input_file, method):
+		return metrics.file(input_file, method) if metrics else nullcontext()
+
+	if threads<=1 or len(jobs)<=1:
+		for input_file, method in jobs:
+			with measure_file(input_file, method) as stats:
+				parsed_profile = parse_files(input_file, method, names, tax, ranks, verbose, stats, memo)
+			yield parsed_profile
+		return
+
+	global pool_args, pool_memo
+	pool_args = (names, tax, ranks, verbose)
+	pool_memo = memo
+	# Imported once, inherited by the pool processes
+	load_pandas()
+	with multiprocessing.get_context('fork').Pool(threads) as pool:
+		# stdin is not available on the pool processes
+		results = [None if input_file=="-" else pool.apply_async(parse_files_job, (input_file, method, metrics is not None)) for input_file, method in jobs]
+		for (input_file, method), result in zip(jobs, results):
+			if result is None:
+				with measure_file(input_file, method) as stats:
+					parsed_profile = parse_files(input_file, method, names, tax, ranks, verbose, stats, memo)
+			else:
+				parsed_profile, log, stats = result.get()
+				sys.stdout.write(log)
+				if metrics: metrics.addFile(stats)
+			yield parsed_profile
+	pool_args = pool_memo = None
+
+def scan_files(jobs, ranks):
+	# Taxids and names referenced by the files, read without the taxonomy (jobs -> [(input_file, method)], lazy taxonomy)
+	# Returns the unique taxids and the {(taxid, name, rank)} of the profiling entries with names
+	pd = load_pandas()
+	taxids = [np.zeros(0, dtype=np.int64)]
+	named = set()
+	for input_file, method in jobs:
+		if method=='b':
+			for chunk_taxids, _ in binning_chunks(input_file, pd):
+				taxids.append(np.unique(chunk_taxids))
+		else:
+			profile_taxids = set()
+			for taxid, name, rank, _ in profiling_entries(input_file, isbioboxes(input_file)):
+				if rank not in ranks.ranks: continue
+				profile_taxids.add(taxid)
+				if name: named.add((taxid, name, rank))
+			taxids.append(np.array(list(profile_taxids), dtype=np.int64))
+	taxids = np.unique(np.concatenate(taxids))
+	return taxids[taxids>0], named
@@ -1,38 +1,153 @@
+import numpy as np
+from array import array
 from collections import defaultdict
 
+from metametamerge.Taxonomy import Taxonomy
+from metametamerge.NameIndex import normalize_name, name_key
+from metametamerge.open_file import open_file
+#from Taxonomy import Taxonomy
+#from NameIndex import normalize_name, name_key
+#from open_file import open_file
+
 def parse_tax(names_file,nodes_file,merged_file,ranks):
 	all_names_scientific = defaultdict(list)
 	all_names_other = defaultdict(list)
-	nodes = {}
+	taxids = []
+	parents = []
+	node_ranks = []
+	names = {}
 	merged = {}
-	
-	for l in open(nodes_file,'r'):
-		taxid, parent_taxid, rank, _ = l.split('\t|\t',3)
-		nodes[int(taxid)] = {'parent':int(parent_taxid),'rank':rank,'name':''}
-	
-	for l in open(merged_file,'r'):
-		old_taxid, new_taxid, _ = l.rstrip().split('\t|',2)
-		merged[int(old_taxid)] = int(new_taxid)
-	
-	for l in open(names_file,'r'):
-		fields = l.split('\t|\t')
-		taxid = int(fields[0])
-		rank = nodes[taxid]['rank']
-		
-		# Only parse selected ranks
-		if rank in ranks.ranks:
-			name = fields[1]
-			nc = fields[3].replace('\t|\n','')
-		
-			if nc=="scientific name":
-				#if (name,rank) in all_names_scientific: print("(WARNING) repeated scientific name (name,rank)", rank, name, taxid, all_names_scientific[(name,rank)])
-				all_names_scientific[(name,rank)].append(taxid)
-			else:
-				#if (name,rank) in all_names_other: print("(WARNING) repeated name (name,rank)", rank, name, taxid, all_names_other[(name,rank)])
-				all_names_other[(name,rank)].append(taxid)
-
-			# Set scientific name to taxid (or any other in case is still empty)
-			if nc=="scientific name" or not nodes[taxid]['name']:
-				nodes[taxid]['name'] = fields[1]
-
-	return all_names_scientific, all_names_other, nodes, merged
+
+	with open_file(nodes_file) as f:
+		for l in f:
+			taxid, parent_taxid, rank, _ = l.split('\t|\t',3)
+			taxids.append(int(taxid))
+			parents.append(int(parent_taxid))
+			node_ranks.append(rank)
+
+	with open_file(merged_file) as f:
+		for l in f:
+			old_taxid, new_taxid, _ = l.rstrip().split('\t|',2)
+			merged[int(old_taxid)] = int(new_taxid)
+
+	# rank by taxid, only needed while reading names.dmp
+	rank_of = dict(zip(taxids, node_ranks))
+	with open_file(names_file) as f:
+		for l in f:
+			fields = l.split('\t|\t')
+			taxid = int(fields[0])
+			rank = rank_of[taxid]
+
+			# Only parse selected ranks
+			if rank in ranks.ranks:
+				name = fields[1]
+				nc = fields[3].replace('\t|\n','')
+
+				if nc=="scientific name":
+					#if (name,rank) in all_names_scientific: print("(WARNING) repeated scientific name (name,rank)", rank, name, taxid, all_names_scientific[(name,rank)])
+					all_names_scientific[(name,rank)].append(taxid)
+				else:
+					#if (name,rank) in all_names_other: print("(WARNING) repeated name (name,rank)", rank, name, taxid, all_names_other[(name,rank)])
+					all_names_other[(name,rank)].append(taxid)
+
+				# Set scientific name to taxid (or any other in case is still empty)
+				if nc=="scientific name" or taxid not in names:
+					names[taxid] = fields[1]
+
+	tax = Taxonomy.fromLists(taxids, parents, node_ranks, names, merged)
+	tax.buildLineage(ranks)
+
+	return all_names_scientific, all_names_other, tax
+
+def parse_tax_lazy(names_file,nodes_file,merged_file,ranks,taxids,named):
+	# Only the nodes referenced by the input files (taxids), their ancestors and their names (lazy taxonomy)
+	# named -> {(taxid, name, rank)} entries resolved by name when the taxid is not valid (scan_files)
+	# Returns the same as parse_tax, with the names tables restricted to the referenced names
+
+	# nodes.dmp is read once into compact arrays, only to walk up the lineages
+	node_taxids = array('i')
+	node_parents = array('i')
+	node_ranks = array('B')
+	rank_codes = {}
+	with open_file(nodes_file) as f:
+		for l in f:
+			taxid, parent_taxid, rank, _ = l.split('\t|\t',3)
+			node_taxids.append(int(taxid))
+			node_parents.append(int(parent_taxid))
+			if rank not in rank_codes: rank_codes[rank] = len(rank_codes)
+			node_ranks.append(rank_codes[rank])
+	rank_names = sorted(rank_codes, key=rank_codes.get)
+	node_taxids = np.frombuffer(node_taxids, dtype=np.int32)
+	parent = np.zeros(node_taxids.max()+1, dtype=np.int32)
+	parent[node_taxids] = np.frombuffer(node_parents, dtype=np.int32)
+	rank = np.zeros(parent.shape[0], dtype=np.uint8)
+	rank[node_taxids] = np.frombuffer(node_ranks, dtype=np.uint8)
+	del node_taxids, node_parents, node_ranks
+
+	# Only merged taxids referenced by the input files
+	referenced = set(taxids.tolist()) | set(taxid for taxid,_,_ in named)
+	merged = {}
+	with open_file(merged_file) as f:
+		for l in f:
+			old_taxid, new_taxid, _ = l.rstrip().split('\t|',2)
+			if int(old_taxid) in referenced: merged[int(old_taxid)] = int(new_taxid)
+
+	loaded = np.zeros(parent.shape[0], dtype=bool)
+	def load_lineages(txids):
+		# Mark the taxids (if in nodes.dmp) and all their ancestors as loaded, returning the ones not loaded before
+		txids = np.asarray(list(txids), dtype=np.int64)
+		txids = txids[(txids>0) & (txids<parent.shape[0])]
+		txids = np.unique(txids[parent[txids]!=0])
+		txids = txids[~loaded[txids]]
+		new = [txids]
+		while txids.size:
+			loaded[txids] = True
+			txids = np.unique(parent[txids])
+			txids = txids[~loaded[txids]]
+			new.append(txids)
+		return np.concatenate(new)
+
+	load_lineages([1] + taxids.tolist() + list(merged.values()))
+	# Names of the entries without a valid taxid
+	name_keys = set(name_key(name,rank_name) for taxid,name,rank_name in named if not (0<taxid<parent.shape[0] and parent[taxid]) and taxid not in merged)
+	normalized_names = set(key.split('\t',1)[1] for key in name_keys)
+
+	all_names_scientific = defaultdict(list)
+	all_names_other = defaultdict(list)
+	names = {}
+	selected_rank = np.array([r in ranks.ranks for r in rank_names], dtype=bool)[rank]
+	def read_names(label):
+		# Names of the taxids to be labeled (label) and the entries matching the referenced names (name_keys), only on selected ranks
+		# flags by taxid (bytearray, fast look-up): 1 -> selected rank, 2 -> label
+		flags = bytearray((selected_rank.astype(np.uint8) | (selected_rank & label).astype(np.uint8)<<1).tobytes())
+		with open_file(names_file) as f:
+			for l in f:
+				taxid = int(l[:l.index('\t')])
+				flag = flags[taxid]
+				if not flag & 2 and not (flag and name_keys): continue
+				fields = l.split('\t|\t')
+				name = fields[1]
+				nc = fields[3].replace('\t|\n','')
+				rank_name = rank_names[rank[taxid]]
+				if name_keys and normalize_name(name) in normalized_names and name_key(name,rank_name) in name_keys:
+					if nc=="scientific name":
+						all_names_scientific[(name,rank_name)].append(taxid)
+					else:
+						all_names_other[(name,rank_name)].append(taxid)
+				if flag & 2 and (nc=="scientific name" or taxid not in names):
+					names[taxid] = name
+
+	read_names(loaded)
+	# Lineages of the taxids found by name, reading again only the names of the new nodes
+	new = load_lineages([taxid for names_table in (all_names_scientific, all_names_other) for t in names_table.values() for taxid in t])
+	if new.size:
+		name_keys = set()
+		label = np.zeros(parent.shape[0], dtype=bool)
+		label[new] = True
+		read_names(label)
+
+	loaded_taxids = np.flatnonzero(loaded)
+	tax = Taxonomy.fromLists(loaded_taxids.tolist(), parent[loaded_taxids].tolist(), [rank_names[r] for r in rank[loaded_taxids]], names, merged)
+	tax.buildLineage(ranks)
+
+	return all_names_scientific, all_names_other, tax
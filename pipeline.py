@@ -0,0 +1,210 @@
+import numpy as np
+import math
+from contextlib import nullcontext
+
+from metametamerge.Tools import Tools
+from metametamerge.Databases import Databases
+from metametamerge.parse_tax import parse_tax, parse_tax_lazy
+from metametamerge.parse_files import scan_files
+from metametamerge.NameIndex import NameIndex
+from metametamerge.tax_cache import load_tax_cache
+from metametamerge.merge_profiles import group_profiles, bin_profiles
+#from Tools import Tools
+#from Databases import Databases
+#from parse_tax import parse_tax, parse_tax_lazy
+#from parse_files import scan_files
+#from NameIndex import NameIndex
+#from tax_cache import load_tax_cache
+#from merge_profiles import group_profiles, bin_profiles
+
+def load_taxonomy(names_file, nodes_file, merged_file, all_ranks, taxonomy_cache="", verbose=False, lazy_jobs=None):
+	print("Parsing taxonomy (names, nodes, merged) ... ")
+	# names -> NameIndex: (name,rank) -> taxid
+	# tax -> Taxonomy: parent, rank, name and merged by taxid **** all nodes.dmp + names.dmp + merged.dmp
+	# lazy_jobs -> [(input_file, method)]: only the taxids and names referenced by these files (and their lineages) are loaded
+	if taxonomy_cache:
+		return load_tax_cache(taxonomy_cache, names_file, nodes_file, merged_file, all_ranks, verbose)
+	elif lazy_jobs:
+		taxids, named = scan_files(lazy_jobs, all_ranks)
+		print("\t%d taxids and %d names referenced by %d files" % (taxids.shape[0], len(named), len(lazy_jobs)))
+		all_names_scientific, all_names_other, tax = parse_tax_lazy(names_file, nodes_file, merged_file, all_ranks, taxids, named)
+		print("\t%d nodes loaded" % np.sum(tax.parent!=0))
+		return NameIndex.fromTables(all_names_scientific, all_names_other), tax
+	else:
+		all_names_scientific, all_names_other, tax = parse_tax(names_file, nodes_file, merged_file, all_ranks)
+		return NameIndex.fromTables(all_names_scientific, all_names_other), tax
+
+def load_databases(database_files, parsed_profiles, ranks):
+	# parsed_profiles -> iterator of parsed database profiles on the same order of database_files
+	print("Reading database profiles ...")
+	return [prepare_database(Databases(database_file, next(parsed_profiles), ranks)) for database_file in database_files]
+
+def prepare_database(db):
+	# Merge repeated taxids (when taxid changes in the new taxonomy version)
+	merged_taxids = db.mergeRepeatedTaxIDs()
+	if merged_taxids: print(("\t%d taxons with merged entries [%s]") % (len(merged_taxids),",".join([str(int(taxid)) for taxid in merged_taxids])))
+	print(("\tTotal - %d taxons") % (db.getSize()))
+	return db
+
+def count_databases(D):
+	# dbs_count -> (sorted taxids, number of database profile entries with each taxid)
+	return np.unique(np.concatenate([db.getCol('TaxID') for db in D] + [np.zeros(0, dtype=np.uint32)]), return_counts=True)
+
+def load_tools(input_files, identifiers, methods, parsed_profiles, D, ranks, verbose):
+	# parsed_profiles -> iterator of parsed profiles on the same order of input_files, D -> database profile for each input file
+	print("Reading profiles ...")
+	return [prepare_tool(Tools(input_file, identifiers[idx], methods[idx], next(parsed_profiles), ranks, verbose), D[idx], ranks, verbose) for idx,input_file in enumerate(input_files)]
+
+def prepare_tool(tool, db, ranks, verbose):
+	# Check presence on it's on database profile
+	tool.checkDB(db, ranks, verbose)
+
+	# Merge repeated taxids (when taxid changes in the new taxonomy version)
+	merged_taxids = tool.mergeRepeatedTaxIDs()
+	if merged_taxids: print(("\t%d taxons with merged entries [%s]") % (len(merged_taxids),",".join([str(int(taxid)) for taxid in merged_taxids])))
+
+	# Estimate abundance for binning methods
+	if tool.method=='b': tool.estimateAbundance(db, ranks, verbose)
+
+	# Normalize abundance
+	tool.normalizeAbundance()
+
+	print(("\tTotal - %d taxons") % (tool.getSize()))
+	return tool
+
+def filter_tools(T, cutoff, ranks):
+	# Filter max results
+	if cutoff>=1:
+		print("Filtering relative abundances (= 0)")
+		for tool in T: tool.filterMinRelativeAbundance(0, ranks)
+		print()
+		print("Filtering profiles (max. results = %d) ..." % cutoff)
+		for tool in T: tool.filterMaxResults(int(cutoff), ranks)
+	elif cutoff>0:
+		print("Filtering profiles (min. relative abundance <= %f) ..." % cutoff)
+		for tool in T: tool.filterMinRelativeAbundance(cutoff, ranks)
+	else:
+		print("Filtering relative abundances (= 0)")
+		for tool in T: tool.filterMinRelativeAbundance(0, ranks)
+
+def merge_tools(T, dbs_count, ranks, bins, groups=None):
+	# Merged results (groups -> already grouped entries of T from group_profiles)
+	print("Merging profiles ...")
+	if groups is None: groups = group_profiles(T, dbs_count)
+	profile_merged, bin_n = bin_profiles(groups, len(T), ranks, bins)
+
+	#Sort by desc. presence and desc. abundance
+	profile_merged.sort([('Abundance',-1),('Presence',-1)])
+
+	for rankid,profilerank in profile_merged:
+		print(("\t%s - %d entries") % (ranks.getRankName(rankid),profilerank.getSize()))
+
+	return profile_merged, bin_n
+
+def guided_cutoff(profile_merged, bin_n, mode_name, ranks, verbose):
+	print("Aplying guided cutoff ...")
+	# Apply guided cutoff based on pre-defined functions (mode)
+	profile_merged_mode = []
+	mode = {}
+	for rankid,profilerank in profile_merged:
+		print("\t%s" % ranks.getRankName(rankid))
+		for bin in range(1,bin_n+1):
+			profile_bin = profilerank.getSubSet(profilerank.getCol('Presence')==bin)
+			bin_c = profile_bin.getSize()
+
+			if mode_name=="linear": #lin
+				mode[(rankid, bin)] = (bin_c, bin / float(bin_n))
+			elif mode_name=="very-sensitive": #log_max
+				mode[(rankid, bin)] = (bin_c, np.log(bin + 3) / float(np.log(bin_n + 3)))
+			elif mode_name=="sensitive": #log
+				mode[(rankid, bin)] = (bin_c, np.log(bin + 1) / float(np.log(bin_n + 1)))
+			elif mode_name=="very-precise": #exp_max
+				mode[(rankid, bin)] = (bin_c, (4 ** bin) / float(4 ** bin_n))
+			elif mode_name=="precise": #exp
+				mode[(rankid, bin)] = (bin_c, (2 ** bin) / float(2 ** bin_n))
+			elif mode_name=="no-cutoff": #do not apply cut-off, just merge results
+				mode[(rankid, bin)] = (bin_c, 1)
+
+			print("\tbin: %d \t # taxons: %d (%d kept - %.2f%%) " % (bin, bin_c, math.ceil(mode[(rankid,bin)][0]*mode[(rankid,bin)][1]), mode[(rankid,bin)][1]*100))
+
+			if bin_c:
+				# Add entry only for taxons above the cutoff
+				for pr in profile_bin.getRow(0,math.ceil(mode[(rankid,bin)][0]*mode[(rankid,bin)][1])):
+					profile_merged_mode.append([pr['Presence'],rankid,pr['TaxID'],pr['Abundance']])
+
+	# Add as a tool (+ normalize the abundance)
+	profile_merged_mode = Tools("", "merged", "p", np.array(profile_merged_mode), ranks, verbose)
+	profile_merged_mode.normalizeAbundance()
+	return profile_merged_mode
+
+def estimate_missing_ranks(profile_merged_mode, tax, ranks, all_ranks, verbose):
+	# Connection between ranks and all_ranks should be done by name (rankid is different)
+	highest_rank_all_ranks = max([all_ranks.getRankID(rank_name) for rank_name in ranks.ranks if rank_name in all_ranks.ranks])
+	missing_ranks = [rank_name for rank_name in all_ranks.ranks if rank_name not in ranks.ranks and all_ranks.getRankID(rank_name) < highest_rank_all_ranks]
+	print(("Estimating missing ranks (%s) from %s ...") % (",".join(missing_ranks),all_ranks.getRankName(highest_rank_all_ranks)))
+
+	profile_estimated = []
+	# Add previous entries
+	for rankid, profilerank in profile_merged_mode:
+		for pr in profilerank:
+			# Covert rankid (ranks) to rankid(all_ranks)
+			profile_estimated.append([pr['Presence'],all_ranks.getRankID(ranks.getRankName(rankid)),pr['TaxID'],pr['Abundance']])
+
+	# Add estimated entries: sum abundances of the highest rank on the ancestors of each missing rank
+	profilerank = profile_merged_mode.profilerank[ranks.getRankID(all_ranks.getRankName(highest_rank_all_ranks))]
+	abundances = profilerank.getCol('Abundance')
+	lineage = tax.getLineage(profilerank.getCol('TaxID'))
+	for rank_name in missing_ranks:
+		ancestors = lineage[:,tax.getLineageRankID(rank_name)]
+		valid = ancestors>0
+		rank_taxids, first_idx, rank_idx = np.unique(ancestors[valid], return_index=True, return_inverse=True)
+		rank_abundances = np.bincount(rank_idx, weights=abundances[valid], minlength=rank_taxids.shape[0])
+		# Order of first occurrence on the highest rank (as when summing them entry by entry)
+		order = np.argsort(first_idx, kind='stable')
+		for txid, ab in zip(rank_taxids[order], rank_abundances[order]):
+			profile_estimated.append([1,all_ranks.getRankID(rank_name),txid,ab])
+
+	# Add as a tool (+ normalize the abundance)
+	profile_merged_mode = Tools("", "merged", "p", np.array(profile_estimated), all_ranks, verbose)
+	profile_merged_mode.normalizeAbundance()
+	return profile_merged_mode
+
+def merge_sample(T, dbs_count, tax, ranks, all_ranks, bins, cutoff, mode, verbose, metrics=None):
+	# Filter, merge and apply the guided cutoff on the tools of one sample, returning the final merged profile (all_ranks)
+	# metrics -> Metrics: measure the merge (with filter) and cutoff stages
+	stage = metrics.stage if metrics else lambda name: nullcontext({})
+	with stage('merge') as record:
+		record['rows_in'] = sum([tool.getSize() for tool in T])
+		print()
+		filter_tools(T, cutoff, ranks)
+
+		print()
+		profile_merged, bin_n = merge_tools(T, dbs_count, ranks, bins)
+		record['rows_out'] = profile_merged.getSize()
+
+	with stage('cutoff') as record:
+		record['rows_in'] = profile_merged.getSize()
+		profile_merged_mode = apply_mode(profile_merged, bin_n, tax, ranks, all_ranks, mode, verbose)
+		record['rows_out'] = profile_merged_mode.getSize()
+	return profile_merged_mode
+
+def apply_mode(profile_merged, bin_n, tax, ranks, all_ranks, mode, verbose):
+	# Apply the guided cutoff on a merged profile (not modified) and estimate missing ranks, returning the final merged profile (all_ranks)
+	print()
+	profile_merged_mode = guided_cutoff(profile_merged, bin_n, mode, ranks, verbose)
+
+	# If only a subset of ranks were analyzed, estimate missing ranks
+	if ranks.ranks!=all_ranks.ranks:
+		print()
+		profile_merged_mode = estimate_missing_ranks(profile_merged_mode, tax, ranks, all_ranks, verbose)
+
+	## ** for here on reference all_ranks instead of ranks
+
+	# Sort merged results (ascending, based on position)
+	profile_merged_mode.sort([('Abundance',-1)])
+	print()
+	print("Final merged profile:")
+	for rankid,profilerank in profile_merged_mode:
+		print(("\t%s - %d entries") % (all_ranks.getRankName(rankid),profilerank.getSize()))
+
+	return profile_merged_mode
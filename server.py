@@ -0,0 +1,175 @@
+import io, os, json, signal, threading, multiprocessing, socketserver
+from argparse import Namespace
+from contextlib import redirect_stdout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from metametamerge.parse_files import parse_files_parallel
+from metametamerge.pipeline import load_taxonomy, load_databases, count_databases, load_tools, merge_sample
+from metametamerge.write_files import write_output, write_detailed, detailed_output_file
+from metametamerge.api import to_text, to_detailed_text
+#from parse_files import parse_files_parallel
+#from pipeline import load_taxonomy, load_databases, count_databases, load_tools, merge_sample
+#from write_files import write_output, write_detailed, detailed_output_file
+#from api import to_text, to_detailed_text
+
+# Request (JSON):
+#  {"input_files": [...], "tool_identifier": [...], "tool_method": [...] (optional, taken from -t/-c),
+#   "output_file": path (optional, otherwise the merged profile is returned), "output_type", "bins", "cutoff", "mode", "detailed" (optional, defaults from the command line)}
+#  {"command": "reload"} or {"command": "ping"}
+# Response (JSON): {"status": "ok"|"error", "log": ..., "output_file"|"profile"|"error": ...}
+request_options = ['output_type','bins','cutoff','mode','detailed']
+
+# Loaded taxonomy and database profiles, inherited by the pool processes on fork
+server_state = None
+
+def run_request(request):
+	D, identifiers, methods, names, tax, ranks, all_ranks, args = server_state
+	if not isinstance(request, dict): raise ValueError("expected a JSON object")
+	options = Namespace(**{o:request.get(o, getattr(args, o)) for o in request_options})
+	input_files = request['input_files']
+	sample_identifiers = request['tool_identifier']
+	unknown = [i for i in sample_identifiers if i not in identifiers]
+	if unknown: raise ValueError("tool identifiers [%s] not loaded on the server" % ",".join(unknown))
+	if "-" in input_files: raise ValueError("stdin (-) is not supported on the server mode")
+	sample_methods = request.get('tool_method') or [methods[identifiers.index(i)] for i in sample_identifiers]
+	if len(input_files)!=len(sample_identifiers) or len(input_files)!=len(sample_methods): raise ValueError("number of input files, tool identifiers and methods should be the same")
+	if not request.get('output_file') and options.output_type=="npz": raise ValueError("npz output requires an output_file")
+	sample_D = [D[identifiers.index(i)] for i in sample_identifiers]
+
+	# Taxids and names resolved once for all the files of this request (not shared among requests)
+	memo = {}
+	parsed_profiles = parse_files_parallel(list(zip(input_files,sample_methods)), names, tax, ranks, args.verbose, 1, memo=memo)
+	T = load_tools(input_files, sample_identifiers, sample_methods, parsed_profiles, sample_D, ranks, args.verbose)
+	profile_merged_mode = merge_sample(T, count_databases(sample_D), tax, ranks, all_ranks, options.bins, options.cutoff, options.mode, args.verbose)
+
+	response = {}
+	output_file = request.get('output_file')
+	if output_file:
+		write_output(output_file, options.output_type, args.nodes_file, profile_merged_mode, tax, all_ranks)
+		if options.detailed: write_detailed(detailed_output_file(output_file), profile_merged_mode, T, sample_D, tax, all_ranks, options.output_type)
+		response['output_file'] = output_file
+	else:
+		# Return the merged profile (and detailed) in the response
+		response['profile'] = to_text(profile_merged_mode, options.output_type, tax, all_ranks, args.nodes_file)
+		if options.detailed: response['detailed'] = to_detailed_text(profile_merged_mode, T, sample_D, tax, all_ranks)
+	return response
+
+def run_request_job(request):
+	# Run one request on a pool process, capturing its log
+	log = io.StringIO()
+	with redirect_stdout(log):
+		try:
+			response = run_request(request)
+			response['status'] = "ok"
+		except Exception as e:
+			response = {'status':"error", 'error':"%s: %s" % (type(e).__name__, e)}
+	response['log'] = log.getvalue()
+	return response
+
+class MergeServer:
+
+	def __init__(self, args, ranks, all_ranks):
+		self.args = args
+		self.ranks = ranks
+		self.all_ranks = all_ranks
+		self.pool = None
+		self.cache_mtime = None
+		self.lock = threading.Lock()
+		self.load()
+
+	def getCacheMtime(self):
+		try:
+			return os.stat(os.path.join(self.args.taxonomy_cache, "cache.json")).st_mtime if self.args.taxonomy_cache else None
+		except OSError:
+			return None
+
+	def load(self):
+		# (Re-)load taxonomy and database profiles and start a new pool of processes with them
+		global server_state
+		args = self.args
+		names, tax = load_taxonomy(args.names_file, args.nodes_file, args.merged_file, self.all_ranks, args.taxonomy_cache, args.verbose)
+		print()
+		parsed_profiles = parse_files_parallel([(database_file,'db') for database_file in args.database_profiles], names, tax, self.ranks, args.verbose, args.threads)
+		D = load_databases(args.database_profiles, parsed_profiles, self.ranks)
+		server_state = (D, args.tool_identifier.split(","), args.tool_method.split(","), names, tax, self.ranks, self.all_ranks, args)
+		self.cache_mtime = self.getCacheMtime()
+
+		old_pool = self.pool
+		self.pool = multiprocessing.get_context('fork').Pool(max(args.threads,1))
+		if old_pool:
+			# Running requests finish with the previous state
+			old_pool.close()
+			threading.Thread(target=old_pool.join, daemon=True).start()
+
+	def reload(self):
+		with self.lock:
+			print("Reloading taxonomy and database profiles ...")
+			self.load()
+
+	def handle(self, request):
+		if not isinstance(request, dict):
+			return {'status':"error", 'error':"Invalid request: expected a JSON object"}
+		if request.get('command')=="ping":
+			return {'status':"ok"}
+		if request.get('command')=="reload":
+			self.reload()
+			return {'status':"ok"}
+		# Taxonomy cache re-built by another process
+		if self.args.taxonomy_cache and self.getCacheMtime()!=self.cache_mtime:
+			with self.lock:
+				if self.getCacheMtime()!=self.cache_mtime:
+					print("Taxonomy cache changed, reloading ...")
+					self.load()
+		with self.lock:
+			result = self.pool.apply_async(run_request_job, (request,))
+		return result.get()
+
+def start_server(address, merge_server):
+	# address: port number -> HTTP on localhost, otherwise path of an Unix socket
+	class UnixHandler(socketserver.StreamRequestHandler):
+		# One JSON request per line
+		def handle(self):
+			for line in self.rfile:
+				if not line.strip(): continue
+				try:
+					response = merge_server.handle(json.loads(line.decode('utf-8')))
+				except ValueError as e:
+					response = {'status':"error", 'error':"Invalid request: %s" % e}
+				self.wfile.write((json.dumps(response) + "\n").encode('utf-8'))
+				self.wfile.flush()
+
+	class HTTPHandler(BaseHTTPRequestHandler):
+		def do_POST(self):
+			try:
+				response = merge_server.handle(json.loads(self.rfile.read(int(self.headers.get('Content-Length',0))).decode('utf-8')))
+			except ValueError as e:
+				response = {'status':"error", 'error':"Invalid request: %s" % e}
+			body = json.dumps(response).encode('utf-8')
+			self.send_response(200 if response['status']=="ok" else 400)
+			self.send_header('Content-Type', 'application/json')
+			self.send_header('Content-Length', str(len(body)))
+			self.end_headers()
+			self.wfile.write(body)
+
+		def log_message(self, format, *args):
+			if merge_server.args.verbose: BaseHTTPRequestHandler.log_message(self, format, *args)
+
+	if address.isdigit():
+		server = ThreadingHTTPServer(('127.0.0.1', int(address)), HTTPHandler)
+		print("Listening on http://127.0.0.1:%s" % address)
+	else:
+		if os.path.exists(address): os.remove(address)
+		server = socketserver.ThreadingUnixStreamServer(address, UnixHandler)
+		print("Listening on %s" % address)
+	server.daemon_threads = True
+
+	# SIGHUP -> reload taxonomy and database profiles
+	signal.signal(signal.SIGHUP, lambda signum, frame: threading.Thread(target=merge_server.reload).start())
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		server.server_close()
+		if not address.isdigit() and os.path.exists(address): os.remove(address)
+		merge_server.pool.terminate()
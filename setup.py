@@ -6,5 +6,5 @@ setup(name='metametamerge',
 	  version='1.1',
       package_dir={'metametamerge': ''},
       packages=['metametamerge'],
-      scripts=['MetaMetaMerge.py']
+      scripts=['MetaMetaMerge.py','MetaMetaCohort.py']
 )
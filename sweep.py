@@ -0,0 +1,54 @@
+import io, os, copy
+from contextlib import redirect_stdout
+
+from metametamerge.merge_profiles import group_profiles
+from metametamerge.pipeline import filter_tools, merge_tools, apply_mode
+from metametamerge.write_files import open_output, write_blocks, write_output, write_detailed, detailed_output_file
+#from merge_profiles import group_profiles
+#from pipeline import filter_tools, merge_tools, apply_mode
+#from write_files import open_output, write_blocks, write_output, write_detailed, detailed_output_file
+
+def sweep_output_file(output_folder, mode, bins, cutoff, output_type):
+	return os.path.join(output_folder, "%s.b%d.r%g%s" % (mode, bins, cutoff, ".npz" if output_type=="npz" else ".out"))
+
+def run_sweep(T, D, dbs_count, tax, ranks, all_ranks, modes, bins_list, cutoffs, args):
+	# Evaluate all combinations of (mode, bins, cutoff) on already parsed and normalized tools (T, not modified)
+	# Tools are filtered and grouped once per cutoff, binned once per (bins, cutoff) and only the guided cutoff runs for each mode
+	# args.sweep_table -> one long-format table on args.output_file, otherwise one output per combination on the output folder (args.output_file)
+	if args.sweep_table:
+		out = open_output(args.output_file)
+		out.write("mode\tbins\tcutoff\trank\ttaxid\tabundance\n")
+	elif not os.path.isdir(args.output_file):
+		os.makedirs(args.output_file)
+
+	print("Sweeping %d combinations (modes: %s, bins: %s, cutoffs: %s) ..." % (len(modes)*len(bins_list)*len(cutoffs), ",".join(modes), ",".join(map(str,bins_list)), ",".join(["%g" % c for c in cutoffs])))
+	for cutoff in cutoffs:
+		T_cutoff = copy.deepcopy(T)
+		# Detailed log of each step only with verbose
+		log = io.StringIO()
+		with redirect_stdout(log):
+			filter_tools(T_cutoff, cutoff, ranks)
+			groups = group_profiles(T_cutoff, dbs_count)
+		if args.verbose: print(log.getvalue())
+		for bins in bins_list:
+			log = io.StringIO()
+			with redirect_stdout(log):
+				profile_merged, bin_n = merge_tools(T_cutoff, dbs_count, ranks, bins, groups)
+			if args.verbose: print(log.getvalue())
+			for mode in modes:
+				log = io.StringIO()
+				with redirect_stdout(log):
+					profile_merged_mode = apply_mode(profile_merged, bin_n, tax, ranks, all_ranks, mode, args.verbose)
+				if args.verbose: print(log.getvalue())
+
+				if args.sweep_table:
+					prefix = "%s\t%d\t%g\t" % (mode,bins,cutoff)
+					write_blocks(out, [prefix + "%s\t%d\t%.16f\n" % (all_ranks.getRankName(rankid),taxid,ab) for rankid, profilerank in profile_merged_mode for taxid,ab in zip(profilerank.getCol('TaxID').tolist(), profilerank.getCol('Abundance').tolist())])
+				else:
+					output_file = sweep_output_file(args.output_file, mode, bins, cutoff, args.output_type)
+					write_output(output_file, args.output_type, args.nodes_file, profile_merged_mode, tax, all_ranks)
+					if args.detailed:
+						write_detailed(detailed_output_file(output_file), profile_merged_mode, T_cutoff, D, tax, all_ranks, args.output_type)
+				print("\tmode: %s \t bins: %d \t cutoff: %g \t # taxons: %d" % (mode, bins, cutoff, profile_merged_mode.getSize()))
+
+	if args.sweep_table: out.close()
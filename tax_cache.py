@@ -0,0 +1,82 @@
+import os, json, hashlib, shutil
+
+from metametamerge.Taxonomy import Taxonomy
+from metametamerge.NameIndex import NameIndex
+from metametamerge.parse_tax import parse_tax
+from metametamerge.check_files import check_tax_cache
+#from Taxonomy import Taxonomy
+#from NameIndex import NameIndex
+#from parse_tax import parse_tax
+#from check_files import check_tax_cache
+
+# Increase when the layout of the cache changes (older caches are rebuilt)
+TAX_CACHE_VERSION = 4
+
+def file_signature(file, with_hash=True):
+	st = os.stat(file)
+	sig = {'path':os.path.abspath(file), 'size':st.st_size, 'mtime':st.st_mtime}
+	if with_hash:
+		md5 = hashlib.md5()
+		with open(file,'rb') as f:
+			for block in iter(lambda: f.read(1 << 20), b''): md5.update(block)
+		sig['md5'] = md5.hexdigest()
+	return sig
+
+def build_tax_cache(cache_dir, names_file, nodes_file, merged_file, ranks):
+	# Never replace a folder that is not a cache (e.g. -x pointing to the folder of the .dmp files)
+	error = check_tax_cache(cache_dir)
+	if error: raise ValueError(error)
+	all_names_scientific, all_names_other, tax = parse_tax(names_file, nodes_file, merged_file, ranks)
+	names = NameIndex.fromTables(all_names_scientific, all_names_other)
+
+	meta = {'version':TAX_CACHE_VERSION,
+			'ranks':ranks.ranks,
+			'sources':{'names':file_signature(names_file), 'nodes':file_signature(nodes_file), 'merged':file_signature(merged_file)}}
+
+	# Write on a temporary folder and move it in place, so concurrent runs never read a partial cache
+	tmp_dir = cache_dir.rstrip('/') + ".tmp%d" % os.getpid()
+	os.makedirs(tmp_dir)
+	tax.save(tmp_dir)
+	names.save(tmp_dir)
+	with open(os.path.join(tmp_dir, "cache.json"),'w') as f: json.dump(meta, f, indent=1)
+	try:
+		if os.path.isdir(cache_dir):
+			# Built by a concurrent run in the meantime
+			if tax_cache_is_valid(cache_dir, names_file, nodes_file, merged_file, ranks): raise OSError("taxonomy cache already built")
+			if check_tax_cache(cache_dir): raise OSError("not a taxonomy cache")
+			# Outdated cache moved aside first (processes using it keep their open/mapped files)
+			old_dir = cache_dir.rstrip('/') + ".old%d" % os.getpid()
+			os.rename(cache_dir, old_dir)
+			shutil.rmtree(old_dir)
+		os.rename(tmp_dir, cache_dir)
+	except OSError:
+		# Another run moved its cache in place first: keep it if valid
+		shutil.rmtree(tmp_dir, ignore_errors=True)
+		if tax_cache_is_valid(cache_dir, names_file, nodes_file, merged_file, ranks):
+			return NameIndex.load(cache_dir), Taxonomy.load(cache_dir)
+
+	return names, tax
+
+def tax_cache_is_valid(cache_dir, names_file, nodes_file, merged_file, ranks):
+	try:
+		with open(os.path.join(cache_dir, "cache.json"),'r') as f: meta = json.load(f)
+	except (IOError, ValueError):
+		return False
+	if meta.get('version')!=TAX_CACHE_VERSION or meta.get('ranks')!=ranks.ranks: return False
+	for source,file in (('names',names_file),('nodes',nodes_file),('merged',merged_file)):
+		cached = meta['sources'][source]
+		current = file_signature(file, with_hash=False)
+		# Cache of another taxonomy (-x pointing to a different set of .dmp files)
+		if current['path']!=cached.get('path'): return False
+		if current['size']!=cached['size']: return False
+		# Same size but touched: only the content hash can tell
+		if current['mtime']!=cached['mtime'] and file_signature(file)['md5']!=cached['md5']: return False
+	return True
+
+def load_tax_cache(cache_dir, names_file, nodes_file, merged_file, ranks, verbose=False):
+	if not tax_cache_is_valid(cache_dir, names_file, nodes_file, merged_file, ranks):
+		print("\tTaxonomy cache [%s] missing or outdated, building ..." % cache_dir)
+		return build_tax_cache(cache_dir, names_file, nodes_file, merged_file, ranks)
+	if verbose: print("\tLoading taxonomy cache [%s]" % cache_dir)
+
+	return NameIndex.load(cache_dir), Taxonomy.load(cache_dir)
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from metametamerge.Ranks import get_ranks
+from metametamerge.NameIndex import NameIndex
+from metametamerge.parse_tax import parse_tax
+from metametamerge.parse_files import parse_files
+
+# taxid, parent, rank
+NODES = [(1,1,"no rank"), (2,1,"superkingdom"), (10,2,"phylum"), (11,10,"no rank"), (20,11,"class"), (30,20,"order"), (40,30,"family"),
+		(50,40,"genus"), (60,50,"species"), (61,50,"species"), (62,60,"no rank"), (51,40,"genus"), (70,51,"species")]
+MERGED = [(99,61)]
+
+# read, taxid, length: reads on species, below species (62), above species (50, 11), merged (99) and not found (12345) taxids
+READS = [("r1",60,100), ("r2",62,50), ("r3",61,30), ("r4",99,20), ("r5",50,40), ("r6",70,10), ("r7",11,5), ("r8",12345,7)]
+
+# Summed length of each taxid on each rank: every read is counted once on each of its ancestors
+EXPECTED = {'superkingdom': {2:255}, 'phylum': {10:255}, 'class': {20:250}, 'order': {30:250}, 'family': {40:250},
+			'genus': {50:240, 51:10}, 'species': {60:150, 61:50, 70:10}}
+
+@pytest.fixture
+def taxonomy(tmp_path):
+	with open(tmp_path / "nodes.dmp", "w") as f:
+		for taxid, parent, rank in NODES: f.write("%d\t|\t%d\t|\t%s\t|\tXX\t|\n" % (taxid, parent, rank))
+	with open(tmp_path / "names.dmp", "w") as f:
+		for taxid, _, _ in NODES: f.write("%d\t|\tname_%d\t|\t\t|\tscientific name\t|\n" % (taxid, taxid))
+	with open(tmp_path / "merged.dmp", "w") as f:
+		for old_taxid, new_taxid in MERGED: f.write("%d\t|\t%d\t|\n" % (old_taxid, new_taxid))
+	ranks, all_ranks = get_ranks("all")
+	all_names_scientific, all_names_other, tax = parse_tax(str(tmp_path / "names.dmp"), str(tmp_path / "nodes.dmp"), str(tmp_path / "merged.dmp"), all_ranks)
+	return NameIndex.fromTables(all_names_scientific, all_names_other), tax, ranks
+
+def rank_sums(parsed_profile, ranks):
+	parsed_profile = np.asarray(parsed_profile).reshape(-1,4)
+	return {rank: {int(taxid): float(length) for _, rankid, taxid, length in parsed_profile if int(rankid)==ranks.getRankID(rank)} for rank in ranks.ranks}
+
+@pytest.mark.parametrize("reverse", [False, True])
+def test_binning_rank_counts(taxonomy, tmp_path, reverse):
+	names, tax, ranks = taxonomy
+	binning_file = tmp_path / "binning.tsv"
+	with open(binning_file, "w") as f:
+		for read, taxid, length in (READS[::-1] if reverse else READS): f.write("%s\t%d\t%d\n" % (read, taxid, length))
+	# Same sums regardless of the order of the reads
+	assert rank_sums(parse_files(str(binning_file), 'b', names, tax, ranks, False), ranks)==EXPECTED
@@ -0,0 +1,38 @@
+import os, json
+import pytest
+
+from metametamerge.Ranks import get_ranks
+from metametamerge.tax_cache import load_tax_cache, TAX_CACHE_VERSION
+
+# taxid, parent, rank
+NODES = [(1,1,"no rank"), (2,1,"superkingdom"), (50,2,"genus"), (60,50,"species")]
+
+def write_dmp(folder):
+	with open(os.path.join(folder, "nodes.dmp"), "w") as f:
+		for taxid, parent, rank in NODES: f.write("%d\t|\t%d\t|\t%s\t|\tXX\t|\n" % (taxid, parent, rank))
+	with open(os.path.join(folder, "names.dmp"), "w") as f:
+		for taxid, _, _ in NODES: f.write("%d\t|\tname_%d\t|\t\t|\tscientific name\t|\n" % (taxid, taxid))
+	with open(os.path.join(folder, "merged.dmp"), "w") as f: f.write("99\t|\t60\t|\n")
+	return [os.path.join(folder, dmp) for dmp in ("names.dmp", "nodes.dmp", "merged.dmp")]
+
+def test_tax_cache_other_folder(tmp_path):
+	# -x pointing to the folder of the .dmp files: nothing is deleted
+	dmp_files = write_dmp(str(tmp_path))
+	with open(tmp_path / "notes.txt", "w") as f: f.write("notes")
+	files = sorted(os.listdir(str(tmp_path)))
+	with pytest.raises(ValueError):
+		load_tax_cache(str(tmp_path), *dmp_files, ranks=get_ranks("all")[1])
+	assert sorted(os.listdir(str(tmp_path)))==files
+	assert (tmp_path / "notes.txt").read_text()=="notes"
+
+@pytest.mark.parametrize("previous", [None, {'version':0}])
+def test_tax_cache_replaced(tmp_path, previous):
+	# Empty folder or outdated cache: built in place
+	dmp_files = write_dmp(str(tmp_path))
+	cache_dir = tmp_path / "cache"
+	cache_dir.mkdir()
+	if previous is not None:
+		with open(cache_dir / "cache.json", "w") as f: json.dump(previous, f)
+	names, tax = load_tax_cache(str(cache_dir), *dmp_files, ranks=get_ranks("all")[1])
+	assert names.lookup('scientific', "name_60", "species")==60
+	with open(cache_dir / "cache.json") as f: assert json.load(f)['version']==TAX_CACHE_VERSION
@@ -0,0 +1,135 @@
+import gzip
+import numpy as np
+from itertools import islice
+from contextlib import nullcontext
+
+from metametamerge.Profile import Profile
+from metametamerge.npz_files import save_npz, profile_arrays
+#from Profile import Profile
+#from npz_files import save_npz, profile_arrays
+
+# Number of lines joined on each write
+WRITE_BLOCK_SIZE = 65536
+
+def open_output(output_file):
+	# Output files ending with .gz are written compressed, file objects (e.g. io.StringIO) are written as they are (not closed)
+	if not isinstance(output_file, str):
+		return nullcontext(output_file)
+	elif output_file.endswith(".gz"):
+		return gzip.open(output_file, 'wt', compresslevel=6)
+	else:
+		return open(output_file, 'w')
+
+def detailed_output_file(output_file):
+	# output.detailed, output.detailed.gz or output.detailed.npz
+	if output_file.endswith(".gz"):
+		return output_file[:-3] + ".detailed.gz"
+	elif output_file.endswith(".npz"):
+		return output_file[:-4] + ".detailed.npz"
+	else:
+		return output_file + ".detailed"
+
+def write_blocks(out, lines):
+	# Write an iterator of lines joined in blocks
+	lines = iter(lines)
+	while True:
+		block = list(islice(lines, WRITE_BLOCK_SIZE))
+		if not block: break
+		out.write("".join(block))
+
+class LineageStrings:
+	# TAXPATH and TAXPATHSN strings (bioboxes) memoized by taxid and lineage ranks, shared between rows and output files
+	def __init__(self, tax):
+		self.tax = tax
+		self.names = {}
+		self.lineages = {}
+
+	def getName(self, taxid):
+		if taxid not in self.names: self.names[taxid] = self.tax.getName(taxid)
+		return self.names[taxid]
+
+	def getLineages(self, taxids, lineage_rankids):
+		# Returns the (TAXPATH, TAXPATHSN) of each taxid up to the lineage ranks (tax.getLineageRankID)
+		lineage_rankids = tuple(lineage_rankids)
+		missing = [taxid for taxid in set(taxids) if (taxid,lineage_rankids) not in self.lineages]
+		if missing:
+			lineage = self.tax.getLineage(missing)[:,list(lineage_rankids)].tolist()
+			for taxid,l in zip(missing, lineage):
+				self.lineages[(taxid,lineage_rankids)] = ("|".join([str(t) if t else "" for t in l]), "|".join([self.getName(t) if t else "" for t in l]))
+		return [self.lineages[(taxid,lineage_rankids)] for taxid in taxids]
+
+def write_parsed_profiles(output_prefix, nodes_file, T, tax, ranks, all_ranks, compress=False, output_type="bioboxes"):
+	#Print tool output for plots (before cutoff - only with normalized/estimated abundances - without entries not found in the DB!!)
+	lineages = LineageStrings(tax)
+	for tool in T:
+		if output_type=="npz":
+			save_npz(output_prefix + tool.ident + ".parsed_profile.npz", profile_arrays(tool, ranks))
+		else:
+			print_bioboxes(output_prefix + tool.ident + ".parsed_profile.out" + (".gz" if compress else ""),nodes_file,tool,tax,ranks,all_ranks,lineages)
+
+def write_output(output_file, output_type, nodes_file, profile_merged_mode, tax, all_ranks):
+	# Print final merged profile
+	if output_type=="tsv":
+		def lines():
+			for rankid, profilerank in profile_merged_mode:
+				rank_name = all_ranks.getRankName(rankid)
+				for taxid,ab in zip(profilerank.getCol('TaxID').tolist(), profilerank.getCol('Abundance').tolist()):
+					yield "%s\t%d\t%.16f\n" % (rank_name,taxid,ab)
+		with open_output(output_file) as out:
+			write_blocks(out, lines())
+	elif output_type=="npz":
+		save_npz(output_file, profile_arrays(profile_merged_mode, all_ranks))
+	else: #bioboxes
+		print_bioboxes(output_file,nodes_file,profile_merged_mode,tax,all_ranks,all_ranks)
+
+def write_detailed(output_file, profile_merged_mode, T, D, tax, all_ranks, output_type=""):
+	# Print detailed profile (D -> database profile of each tool)
+	# Identified by the tool -> abundance, not identified but present -> 0, not present in the db -> -1
+	# Index taxids of each tool and database profile once
+	T_index = [tool.getTaxIDIndex() for tool in T]
+	D_index = [D[toolid].getTaxIDIndex() for toolid in range(len(T))]
+	def detailed(taxids):
+		# Columns (found on the tool, found on the database, abundance) for each tool
+		cols = []
+		for toolid in range(len(T)):
+			pres_t, ab_t = Profile.lookupTaxIDs(T_index[toolid], taxids)
+			pres_d, _ = Profile.lookupTaxIDs(D_index[toolid], taxids)
+			cols.append((pres_t, pres_d, ab_t))
+		return cols
+
+	if output_type=="npz":
+		arrays = profile_arrays(profile_merged_mode, all_ranks)
+		arrays['tools'] = np.array([t.ident for t in T])
+		arrays['detailed'] = np.column_stack([np.where(t, ab, np.where(d, 0., -1.)) for t,d,ab in detailed(arrays['taxid'])] + [np.zeros((arrays['taxid'].shape[0],0))])
+		save_npz(output_file, arrays)
+		return
+
+	lineages = LineageStrings(tax)
+	def lines():
+		yield "rank\ttaxid\tname\tmetametamerge\t" + '\t'.join([t.ident for t in T]) + '\n'
+		for rankid, profilerank in profile_merged_mode:
+			taxids = profilerank.getCol('TaxID')
+			cols = [["%.16f\t" % ab if t else ("0\t" if d else "-1\t") for t,d,ab in zip(pres_t.tolist(), pres_d.tolist(), ab_t.tolist())] for pres_t, pres_d, ab_t in detailed(taxids)]
+			rank_name = all_ranks.getRankName(rankid)
+			for i,(taxid,ab) in enumerate(zip(taxids.tolist(), profilerank.getCol('Abundance').tolist())):
+				yield "%s\t%d\t%s\t%.16f\t%s\n" % (rank_name,taxid,lineages.getName(taxid),ab,"".join([col[i] for col in cols]))
+	with open_output(output_file) as out:
+		write_blocks(out, lines())
+
+def print_bioboxes(output_file,nodes_file,profile_merged_mode,tax,ranks,all_ranks,lineages=None):
+	if lineages is None: lineages = LineageStrings(tax)
+	def lines():
+		yield "# Taxonomic Profiling Output\n"
+		yield "@SampleID:%s\n" % (output_file if isinstance(output_file, str) else getattr(output_file, 'name', ""))
+		yield "@Version:0.9.3\n"
+		yield "@Ranks:%s\n" % '|'.join(ranks.ranks)
+		yield "@TaxonomyID:%s\n" % nodes_file
+		yield "@@TAXID\tRANK\tTAXPATH\tTAXPATHSN\tPERCENTAGE\n"
+		for rankid, profilerank in profile_merged_mode:
+			# Get rank by name relative to all ranks to output the full lineage
+			lineage_rankids = [tax.getLineageRankID(r) for r in all_ranks.ranks[0:all_ranks.getRankID(ranks.getRankName(rankid))+1]]
+			taxids = profilerank.getCol('TaxID').tolist()
+			for txid,(taxid_lineage,name_lineage),ab in zip(taxids, lineages.getLineages(taxids, lineage_rankids), profilerank.getCol('Abundance').tolist()):
+				yield "%d\t%s\t%s\t%s\t%.6f\n" % (txid, tax.getRank(txid), taxid_lineage, name_lineage, ab)
+	with open_output(output_file) as out:
+		write_blocks(out, lines())